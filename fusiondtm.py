@@ -0,0 +1,158 @@
+# ----------------------------------------------------------------------------------------
+# fusiondtm.py
+# Native reader/writer for FUSION (PLANS) binary .dtm surfaces, so canopy and
+# bare earth models can be used as raster.rasterobject instances without a
+# DTM2ASCII/ASCII2DTM round trip.
+#
+# PLANS DTM layout (little endian): a 200 byte header followed by elevations
+# stored column by column from the south west origin, each column running
+# south to north. Areas without data are stored as -1.
+#
+# for FUSION information and downloads:
+#   http://forsys.cfr.washington.edu/fusion/fusionlatest.html
+# ----------------------------------------------------------------------------------------
+import struct
+import numpy
+import raster
+
+strSignature = 'PLANS-PC BINARY .DTM'
+intHeaderBytes = 200
+fltDTMNODATA = -1.0
+# header: signature, name, version, origin x/y, max x/y, columns, points per
+# column, column/point spacing, min/max z, xy units, z units, z data type
+# (version 2.0 on), coordinate system, zone, horizontal datum, vertical datum
+# (version 3.0 on)
+strHeaderFormat = '<21s61sf4d2i4d3h4h'
+# z data type codes (version 2.0 and later, short integers before)
+dicZTypes = {0: numpy.int16,
+             1: numpy.int32,
+             2: numpy.float32,
+             3: numpy.float64}
+# default header codes, as pyfusion ('m m 1 zone 2 2'): meters, meters, UTM, NAD83, NAVD88
+dicDefaultInfo = {'xyunits': 1,
+                  'zunits': 1,
+                  'coordsys': 1,
+                  'zone': 0,
+                  'hdatum': 2,
+                  'vdatum': 2,
+                  'name': ''}
+intWriteColumns = 256
+
+def ReadDTMHeader(strPathDTM):
+    """ Return a dictionary of the header values of PLANS dtm strPathDTM. """
+    with open(strPathDTM, 'rb') as inDTM:
+        strHeader = inDTM.read(struct.calcsize(strHeaderFormat))
+    tupVals = struct.unpack(strHeaderFormat, strHeader)
+    if not tupVals[0].startswith(strSignature):
+        raise Exception(strPathDTM + ' is not a PLANS binary dtm')
+
+    dicHeader = {'name':     tupVals[1].split('\0')[0].strip(),
+                 'version':  tupVals[2],
+                 'originx':  tupVals[3],
+                 'originy':  tupVals[4],
+                 'maxx':     tupVals[5],
+                 'maxy':     tupVals[6],
+                 'columns':  tupVals[7],
+                 'points':   tupVals[8],
+                 'colspacing': tupVals[9],
+                 'ptspacing':  tupVals[10],
+                 'minz':     tupVals[11],
+                 'maxz':     tupVals[12],
+                 'xyunits':  tupVals[13],
+                 'zunits':   tupVals[14],
+                 'ztype':    0,
+                 'coordsys': 0,
+                 'zone':     0,
+                 'hdatum':   0,
+                 'vdatum':   0}
+    # fields added by later versions, zero (unknown) in older files
+    if dicHeader['version'] >= 2.0:
+        dicHeader['ztype'] = tupVals[15]
+    if dicHeader['version'] >= 3.0:
+        dicHeader.update(zip(['coordsys', 'zone', 'hdatum', 'vdatum'], tupVals[16:20]))
+    return dicHeader
+
+def ReadDTM(strPathDTM, bolMemmap = True):
+    """ Return PLANS dtm strPathDTM as a raster.rasterobject.
+        Grid points are treated as cell centers (as DTM2ASCII /raster).
+        bolMemmap True: data is a north up view of a read only memmap of the
+            file, nothing is read until used. Otherwise data is read into a
+            C ordered array.
+        The dtm header codes (units, coordinate system, zone, datums, name)
+        are kept as the rasterobject attribute dtminfo for WriteDTM.
+    """
+    dicHeader = ReadDTMHeader(strPathDTM)
+    if dicHeader['ztype'] not in dicZTypes:
+        raise Exception('unknown dtm z data type ' + str(dicHeader['ztype']))
+    if abs(dicHeader['colspacing'] - dicHeader['ptspacing']) > 1e-9 * dicHeader['colspacing']:
+        raise Exception('dtm column and point spacing differ, not a square cell raster')
+
+    intCols, intRows = dicHeader['columns'], dicHeader['points']
+    dt = numpy.dtype(dicZTypes[dicHeader['ztype']]).newbyteorder('<')
+    arrCols = numpy.memmap(strPathDTM, dtype=dt, mode='r', offset=intHeaderBytes, shape=(intCols, intRows))
+    # columns run south to north: transpose and flip for north up rows
+    arrData = arrCols.T[::-1]
+    if not bolMemmap:
+        arrData = numpy.ascontiguousarray(arrData)
+        del arrCols
+
+    fltCS = dicHeader['colspacing']
+    outrast = raster.ArrayToRaster(arrData,
+                                   dicHeader['originx'] - fltCS / 2.0,
+                                   dicHeader['originy'] - fltCS / 2.0,
+                                   fltCS,
+                                   fltDTMNODATA)
+    outrast.dtminfo = dict([(k, dicHeader[k]) for k in dicDefaultInfo])
+    return outrast
+
+def WriteDTM(rast, strPathDTM, dicInfo = None, dtype = numpy.float32):
+    """ Write raster.rasterobject rast to PLANS dtm strPathDTM.
+        NODATA cells are written as -1.
+            dicInfo: header codes overriding rast.dtminfo (if present) and
+                     dicDefaultInfo, keys: xyunits, zunits, coordsys, zone,
+                     hdatum, vdatum, name. e.g. {'zone': 10}
+            dtype: elevation type, one of dicZTypes values
+        Returns strPathDTM
+    """
+    dicAll = dict(dicDefaultInfo)
+    dicAll.update(getattr(rast, 'dtminfo', {}))
+    if dicInfo:
+        dicAll.update(dicInfo)
+    dt = numpy.dtype(dtype)
+    lstZType = [k for k, v in dicZTypes.items() if numpy.dtype(v) == dt]
+    if not lstZType:
+        raise Exception('dtm elevations must be one of ' + str(dicZTypes.values()))
+
+    arrMask = rast.GetMask()
+    arrValid = rast.data[~arrMask]
+    if arrValid.shape[0]:
+        fltMinZ, fltMaxZ = float(arrValid.min()), float(arrValid.max())
+    else:
+        fltMinZ, fltMaxZ = fltDTMNODATA, fltDTMNODATA
+    del arrValid
+
+    fltCS = rast.fltcellesize
+    fltOX = rast.fltxll + fltCS / 2.0
+    fltOY = rast.fltyll + fltCS / 2.0
+    strHeader = struct.pack(strHeaderFormat,
+                            strSignature,
+                            str(dicAll['name'])[:60],
+                            3.1,
+                            fltOX, fltOY,
+                            fltOX + (rast.intcols - 1) * fltCS,
+                            fltOY + (rast.introws - 1) * fltCS,
+                            rast.intcols, rast.introws,
+                            fltCS, fltCS,
+                            fltMinZ, fltMaxZ,
+                            int(dicAll['xyunits']), int(dicAll['zunits']), lstZType[0],
+                            int(dicAll['coordsys']), int(dicAll['zone']),
+                            int(dicAll['hdatum']), int(dicAll['vdatum']))
+
+    with open(strPathDTM, 'wb') as outDTM:
+        outDTM.write(strHeader.ljust(intHeaderBytes, '\0'))
+        # columns written a block at a time, each south to north
+        for c0 in range(0, rast.intcols, intWriteColumns):
+            c1 = min(c0 + intWriteColumns, rast.intcols)
+            arrBlock = numpy.where(arrMask[::-1, c0:c1], fltDTMNODATA, rast.data[::-1, c0:c1])
+            numpy.ascontiguousarray(arrBlock.T, dtype=dt.newbyteorder('<')).tofile(outDTM)
+    return strPathDTM
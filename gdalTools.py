@@ -1,12 +1,31 @@
 import os
+import numpy
 #import arcpy
-#from osgeo import gdal
-#from osgeo.gdalconst import GDT_Float32
+try:
+    from osgeo import gdal
+    from osgeo.gdalconst import GDT_Float32
+except ImportError:
+    # native ENVI/AAIGrid functions below work without GDAL
+    gdal = None
 
 strGdalPath = r'C:\Python27\ArcGISx6410.3\Lib\site-packages\osgeo'
 dicShortNameFormats = {'.dat': 'ENVI',
                        '.asc': 'AAIGrid',
                        '.bmp': 'BMP'}
+# formats handled natively (numpy) by gdalCopy, gdalEvenCrop and gdalClip.
+# raster (and through it arcpy) is imported only by the AAIGrid branches
+lstNativeFormats = ['ENVI', 'AAIGrid']
+
+# ENVI data type codes
+dicENVITypes = {1: numpy.uint8,
+                2: numpy.int16,
+                3: numpy.int32,
+                4: numpy.float32,
+                5: numpy.float64,
+                12: numpy.uint16,
+                13: numpy.uint32,
+                14: numpy.int64,
+                15: numpy.uint64}
 
 def GetASCIIrasterSize(strPathASC, strMethod):
     """ function to get ascii raster size by various methods """
@@ -86,13 +105,20 @@ def gdal_translateCMD_crop(strPathIn, strPathOut, intCropSize, strMethod = None)
     return strCMD
 
 def gdalCopy(strRastIn, strRastOut):
-    """function to copy a raster to other format"""
+    """function to copy a raster to other format
+    ENVI and AAIGrid inputs and outputs are copied natively, without GDAL.
+    """
     
     # outputFormat
     strEXT = strRastOut[-4:]
     if strEXT not in dicShortNameFormats.keys():
         raise KeyError, 'gdal_translateCMD KeyError: "' + strEXT + '" not in shortname lookup'
     strShortName = dicShortNameFormats[strEXT]
+
+    if IsNative(strRastIn) and IsNative(strRastOut):
+        arrData, tupGT, fltNODATA, dicInfo = ReadNative(strRastIn)
+        WriteNative(strRastOut, arrData, tupGT, fltNODATA, dicInfo)
+        return
     
     # get input
     dataset = gdal.Open(strRastIn)
@@ -106,12 +132,17 @@ def gdalCopy(strRastIn, strRastOut):
 
 def gdalEvenCrop(strRastIn, strRastOut, intCrop):
     """function to subset a raster and save output in ENVI dat format.
-    requires ReadAsArray() which doesn't currently work!
+    GDAL path requires ReadAsArray() which doesn't currently work!
+    ENVI and AAIGrid inputs are cropped natively by array slicing, without GDAL.
     
     strRastIn: input raster, any format
     strRastOut: output raster, ENVI dat only
     intCrop: number of pixels to remove arround edge of image.
     """
+    if IsNative(strRastIn):
+        intWidthX, intWidthY = NativeSize(strRastIn)
+        return NativeWindow(strRastIn, strRastOut, intCrop, intCrop,
+                            intWidthY - 2 * intCrop, intWidthX - 2 * intCrop)
     
     # get input
     inDs = gdal.Open(strRastIn)
@@ -145,7 +176,9 @@ def gdalEvenCrop(strRastIn, strRastOut, intCrop):
 
 def gdalClip(strRastIn, strRastOut, lstExt):
     """function to subset a raster and save output in ENVI dat format.
-    requires ReadAsArray() which doesn't currently work!
+    GDAL path requires ReadAsArray() which doesn't currently work!
+    ENVI and AAIGrid inputs are clipped natively by array slicing, without
+    GDAL; parts of the extent outside the input are filled with NODATA.
     
     strRastIn: input raster, any format
     strRastOut: output raster, ENVI dat only
@@ -158,6 +191,16 @@ def gdalClip(strRastIn, strRastOut, lstExt):
     fltMinY = float(strMinY)
     fltMaxX = float(strMaxX)
     fltMaxY = float(strMaxY)
+
+    if IsNative(strRastIn):
+        tupInGT = NativeGeoTransform(strRastIn)
+        fltXPixelSize = abs(tupInGT[1])
+        fltYPixelSize = abs(tupInGT[5])
+        intCol0 = int(round((fltMinX - tupInGT[0]) / fltXPixelSize))
+        intRow0 = int(round((tupInGT[3] - fltMaxY) / fltYPixelSize))
+        intCols = int(round((fltMaxX - fltMinX) / fltXPixelSize))
+        intRows = int(round((fltMaxY - fltMinY) / fltYPixelSize))
+        return NativeWindow(strRastIn, strRastOut, intRow0, intCol0, intRows, intCols)
     
     # get input
     inDs = gdal.Open(strRastIn)
@@ -178,8 +221,8 @@ def gdalClip(strRastIn, strRastOut, lstExt):
     # crop
     arrData = inBand.ReadAsArray(MinXpix, MaxYpix, intWidthX, intWidthY)
     # create output GeoTransform
-    fltMinX = tupInGT[0] + tupInGT[1]* intCrop
-    fltMaxY = tupInGT[3] + tupInGT[5]* intCrop
+    fltMinX = tupInGT[0] + tupInGT[1]* MinXpix
+    fltMaxY = tupInGT[3] + tupInGT[5]* MaxYpix
     tupOutGT = (fltMinX, tupInGT[1], tupInGT[2], fltMaxY, tupInGT[4], tupInGT[5])
 
     # create output
@@ -198,3 +241,224 @@ def gdalClip(strRastIn, strRastOut, lstExt):
     inDs = None
     outDs = None
     
+
+# -------------------------------------------------------
+# native ENVI (raw binary + .hdr) and AAIGrid support
+# band data is memory mapped, so crops, clips and copies are array slicing.
+# Rasters are handled as (bands, rows, cols) arrays plus a GDAL style
+# GeoTransform (MinX, XSize, 0, MaxY, 0, -YSize).
+
+def ENVIHeaderPath(strPathDAT):
+    """ Return the existing .hdr of ENVI file strPathDAT (file.hdr or file.dat.hdr),
+        or file.hdr if neither exists. """
+    strPathHDR = os.path.splitext(strPathDAT)[0] + '.hdr'
+    if not os.path.exists(strPathHDR) and os.path.exists(strPathDAT + '.hdr'):
+        return strPathDAT + '.hdr'
+    return strPathHDR
+
+def ReadENVIHeader(strPathHDR):
+    """ Return a dictionary of ENVI header strPathHDR, keys lower case, values
+        as strings ({} lists keep their braces stripped). """
+    dicHeader = {}
+    with open(strPathHDR) as inHDR:
+        strText = inHDR.read()
+    if not strText.startswith('ENVI'):
+        raise Exception(strPathHDR + ' is not an ENVI header')
+    lstLines = strText.splitlines()[1:]
+    i = 0
+    while i < len(lstLines):
+        strLine = lstLines[i]
+        i += 1
+        if '=' not in strLine:
+            continue
+        strKey, strVal = strLine.split('=', 1)
+        strVal = strVal.strip()
+        if strVal.startswith('{'):
+            # brace values may span lines
+            while '}' not in strVal and i < len(lstLines):
+                strVal += ' ' + lstLines[i].strip()
+                i += 1
+            strVal = strVal.strip()[1:-1].strip()
+        dicHeader[strKey.strip().lower()] = strVal
+    return dicHeader
+
+def MapInfoToGeoTransform(strMapInfo):
+    """ Return a GeoTransform tuple from the items of an ENVI map info value. """
+    lstMap = [v.strip() for v in strMapInfo.split(',')]
+    fltRefX, fltRefY = float(lstMap[1]), float(lstMap[2])
+    fltEast, fltNorth = float(lstMap[3]), float(lstMap[4])
+    fltXSize, fltYSize = float(lstMap[5]), float(lstMap[6])
+    # reference pixel is 1 based
+    return (fltEast - (fltRefX - 1) * fltXSize, fltXSize, 0.0,
+            fltNorth + (fltRefY - 1) * fltYSize, 0.0, -fltYSize)
+
+def ReadENVI(strPathDAT, bolMemmap = True):
+    """ Return (data, GeoTransform, NODATA, info) for ENVI file strPathDAT.
+        data is a (bands, rows, cols) array: a view of a read only memmap of
+        the file whatever the interleave, or an in memory copy if bolMemmap
+        is False. NODATA is the 'data ignore value' or None.
+        info is the header dictionary (map info, coordinate system string, ...)
+    """
+    dicHeader = ReadENVIHeader(ENVIHeaderPath(strPathDAT))
+    intCols = int(dicHeader['samples'])
+    intRows = int(dicHeader['lines'])
+    intBands = int(dicHeader.get('bands', 1))
+    intOffset = int(dicHeader.get('header offset', 0))
+    dt = numpy.dtype(dicENVITypes[int(dicHeader['data type'])])
+    if int(dicHeader.get('byte order', 0)) == 1:
+        dt = dt.newbyteorder('>')
+    else:
+        dt = dt.newbyteorder('<')
+
+    strInterleave = dicHeader.get('interleave', 'bsq').lower()
+    if strInterleave == 'bsq':
+        arrData = numpy.memmap(strPathDAT, dtype=dt, mode='r', offset=intOffset, shape=(intBands, intRows, intCols))
+    elif strInterleave == 'bil':
+        arrData = numpy.memmap(strPathDAT, dtype=dt, mode='r', offset=intOffset, shape=(intRows, intBands, intCols)).transpose(1, 0, 2)
+    elif strInterleave == 'bip':
+        arrData = numpy.memmap(strPathDAT, dtype=dt, mode='r', offset=intOffset, shape=(intRows, intCols, intBands)).transpose(2, 0, 1)
+    else:
+        raise Exception('unknown ENVI interleave ' + strInterleave)
+    if not bolMemmap:
+        arrData = numpy.array(arrData)
+
+    if 'map info' in dicHeader:
+        tupGT = MapInfoToGeoTransform(dicHeader['map info'])
+    else:
+        tupGT = (0.0, 1.0, 0.0, float(intRows), 0.0, -1.0)
+    fltNODATA = None
+    if 'data ignore value' in dicHeader:
+        fltNODATA = float(dicHeader['data ignore value'])
+    return arrData, tupGT, fltNODATA, dicHeader
+
+def WriteENVI(strPathDAT, arrData, tupGT, fltNODATA = -9999, strProjection = None, dicInfo = None):
+    """ Write (bands, rows, cols) or (rows, cols) array arrData as a band
+        sequential ENVI file strPathDAT plus .hdr with map info and
+        data ignore value.
+            strProjection: optional WKT, written as coordinate system string
+            dicInfo: optional source header (from ReadENVI): map projection
+                     name, zone, datum and units of its map info are kept
+        Returns strPathDAT
+    """
+    arrData = numpy.asarray(arrData)
+    if arrData.ndim == 2:
+        arrData = arrData[numpy.newaxis]
+    intBands, intRows, intCols = arrData.shape
+    dt = arrData.dtype.newbyteorder('=')
+    lstCode = [k for k, v in dicENVITypes.items() if numpy.dtype(v) == dt]
+    if not lstCode:
+        raise Exception('no ENVI data type for ' + str(arrData.dtype))
+
+    # map info: name, ref pixel, ref coords, pixel size, then projection extras
+    lstMapName = ['Arbitrary']
+    lstMapExtra = ['units=Meters']
+    if dicInfo and 'map info' in dicInfo:
+        lstMap = [v.strip() for v in dicInfo['map info'].split(',')]
+        lstMapName = lstMap[:1]
+        lstMapExtra = lstMap[7:]
+    lstMap = lstMapName + ['1', '1', repr(tupGT[0]), repr(tupGT[3]), repr(tupGT[1]), repr(abs(tupGT[5]))] + lstMapExtra
+    if strProjection is None and dicInfo:
+        strProjection = dicInfo.get('coordinate system string')
+
+    lstHeader = ['ENVI',
+                 'samples = ' + str(intCols),
+                 'lines = ' + str(intRows),
+                 'bands = ' + str(intBands),
+                 'header offset = 0',
+                 'file type = ENVI Standard',
+                 'data type = ' + str(lstCode[0]),
+                 'interleave = bsq',
+                 'byte order = ' + str(int(not numpy.little_endian)),
+                 'map info = {' + ', '.join(lstMap) + '}']
+    if strProjection:
+        lstHeader.append('coordinate system string = {' + strProjection + '}')
+    if fltNODATA is not None:
+        lstHeader.append('data ignore value = ' + repr(fltNODATA))
+    with open(os.path.splitext(strPathDAT)[0] + '.hdr', 'w') as outHDR:
+        outHDR.write('\n'.join(lstHeader) + '\n')
+
+    with open(strPathDAT, 'wb') as outDAT:
+        for b in range(intBands):
+            for r in range(0, intRows, 1024):
+                numpy.ascontiguousarray(arrData[b, r:r + 1024], dtype=dt).tofile(outDAT)
+    return strPathDAT
+
+def IsNative(strPathRast):
+    """ True if strPathRast is a format handled without GDAL (lstNativeFormats). """
+    return dicShortNameFormats.get(os.path.splitext(strPathRast)[1].lower()) in lstNativeFormats
+
+def NativeSize(strPathRast):
+    """ Return (width, height) of a native format raster from its header. """
+    if dicShortNameFormats[os.path.splitext(strPathRast)[1].lower()] == 'AAIGrid':
+        import raster
+        rast = raster.rasterobject(strPathRast, ingest = False)
+        return rast.intcols, rast.introws
+    dicHeader = ReadENVIHeader(ENVIHeaderPath(strPathRast))
+    return int(dicHeader['samples']), int(dicHeader['lines'])
+
+def NativeGeoTransform(strPathRast):
+    """ Return the GeoTransform of a native format raster from its header. """
+    if dicShortNameFormats[os.path.splitext(strPathRast)[1].lower()] == 'AAIGrid':
+        import raster
+        rast = raster.rasterobject(strPathRast, ingest = False)
+        return (rast.fltxll, rast.fltcellesize, 0.0,
+                rast.fltyll + rast.introws * rast.fltcellesize, 0.0, -rast.fltcellesize)
+    return ReadNative(strPathRast)[1]
+
+def ReadNative(strPathRast):
+    """ Return (data, GeoTransform, NODATA, info) for a native format raster,
+        see ReadENVI. AAIGrid data is read without ingest through a
+        raster.rasterobject, so windows read only the rows they need.
+    """
+    if dicShortNameFormats[os.path.splitext(strPathRast)[1].lower()] == 'AAIGrid':
+        import raster
+        rast = raster.rasterobject(strPathRast, ingest = False)
+        tupGT = (rast.fltxll, rast.fltcellesize, 0.0,
+                 rast.fltyll + rast.introws * rast.fltcellesize, 0.0, -rast.fltcellesize)
+        return rast, tupGT, rast.fltNODATA, {}
+    return ReadENVI(strPathRast)
+
+def WriteNative(strPathRast, arrData, tupGT, fltNODATA, dicInfo = None):
+    """ Write a (bands, rows, cols) array (or rasterobject, from ReadNative)
+        to a native format raster. AAIGrid output is the first band only.
+    """
+    if fltNODATA is None:
+        fltNODATA = -9999
+    if hasattr(arrData, 'ReadWindow'):
+        # raster.rasterobject
+        arrData = arrData.ReadWindow(0, 0, arrData.introws, arrData.intcols)[numpy.newaxis]
+    if dicShortNameFormats[os.path.splitext(strPathRast)[1].lower()] == 'AAIGrid':
+        import raster
+        rast = raster.ArrayToRaster(arrData[0], tupGT[0], tupGT[3] + arrData.shape[1] * tupGT[5], tupGT[1], fltNODATA)
+        return rast.SaveSelfAs(strPathRast)
+    return WriteENVI(strPathRast, arrData, tupGT, fltNODATA, None, dicInfo)
+
+def NativeWindow(strRastIn, strRastOut, intRow0, intCol0, intRows, intCols):
+    """ Write the window of intRows x intCols starting at intRow0, intCol0 of
+        native format raster strRastIn to strRastOut (ENVI or AAIGrid, float32
+        for ENVI). Window parts outside the input are NODATA.
+    """
+    if dicShortNameFormats[os.path.splitext(strRastIn)[1].lower()] == 'AAIGrid' and \
+       dicShortNameFormats[os.path.splitext(strRastOut)[1].lower()] == 'AAIGrid':
+        # ascii to ascii streams line by line
+        import raster
+        return raster.WindowASCII(strRastIn, strRastOut, intRow0, intCol0, intRows, intCols)
+    arrData, tupGT, fltNODATA, dicInfo = ReadNative(strRastIn)
+    if fltNODATA is None:
+        fltNODATA = -9999
+    if hasattr(arrData, 'ReadWindow'):
+        # raster.rasterobject
+        arrOut = arrData.ReadWindow(intRow0, intCol0, intRows, intCols)[numpy.newaxis]
+    else:
+        intBands, intInRows, intInCols = arrData.shape
+        arrOut = numpy.zeros((intBands, intRows, intCols), dtype=numpy.float32)
+        arrOut.fill(fltNODATA)
+        r0, r1 = max(intRow0, 0), min(intRow0 + intRows, intInRows)
+        c0, c1 = max(intCol0, 0), min(intCol0 + intCols, intInCols)
+        if r0 < r1 and c0 < c1:
+            arrOut[:, r0-intRow0:r1-intRow0, c0-intCol0:c1-intCol0] = arrData[:, r0:r1, c0:c1]
+    tupOutGT = (tupGT[0] + tupGT[1] * intCol0, tupGT[1], tupGT[2],
+                tupGT[3] + tupGT[5] * intRow0, tupGT[4], tupGT[5])
+    if dicShortNameFormats[os.path.splitext(strRastOut)[1].lower()] == 'ENVI':
+        arrOut = arrOut.astype(numpy.float32)
+    return WriteNative(strRastOut, arrOut, tupOutGT, fltNODATA, dicInfo)
@@ -1,5 +1,6 @@
 import os, numpy, arcpy, time
-from multiprocessing import Process, Queue, current_process, freeze_support
+import raster
+from multiprocessing import Process, Pipe, current_process, freeze_support
 
 def elapsed_time(t):
     """ Return a string of format 'hh:mm:ss', representing time elapsed between
@@ -12,10 +13,12 @@ def elapsed_time(t):
     return str(h).zfill(2) + ":" + str(m).zfill(2) + ":" + str(s).zfill(2)
 
 # Function run by worker processes
-def worker(input, output):
-    for func, args in iter(input.get, 'STOP'):
+# each worker has its own pipe, so the pool knows which task a dead worker
+# held and a killed worker cannot stall the others on a shared queue lock
+def worker(conn):
+    for i, func, args in iter(conn.recv, 'STOP'):
         result = calculate(func, args)
-        output.put(result)
+        conn.send((i, result))
         
 # Function used to calculate result
 def calculate(func, args):
@@ -70,23 +73,25 @@ def SaveBand(lstargs):
 def ClipRaster(lstargs):
     t0 = time.time()
     strPathIn, strPathOut, strBND, strComment = lstargs
-    strPathInter = strPathOut[:-4] + '_temp.img'
-    arcpy.env.pyramid = 'NONE'
-    #arcpy.ASCIIToRaster_conversion(in_ascii_file=strPathIn, out_raster=strPathInter, data_type="FLOAT")
-    arcpy.Clip_management(strPathIn, strBND, strPathOut)
-    #arcpy.Delete_management(strPathInter)
+    if strPathIn.lower().endswith('.asc') and strPathOut.lower().endswith('.asc'):
+        # ascii grids are clipped natively, streaming line by line
+        raster.ClipASCII(strPathIn, strPathOut, strBND)
+    else:
+        strPathInter = strPathOut[:-4] + '_temp.img'
+        arcpy.env.pyramid = 'NONE'
+        #arcpy.ASCIIToRaster_conversion(in_ascii_file=strPathIn, out_raster=strPathInter, data_type="FLOAT")
+        arcpy.Clip_management(strPathIn, strBND, strPathOut)
+        #arcpy.Delete_management(strPathInter)
     t = elapsed_time(t0)
     return strComment + ", " + t
 
 def CropRaster(lstargs):
+    """ remove intCells cells around the edge of ascii grid strPathIn,
+        streamed to strPathOut without arcpy or full loads (raster.CropASCII)
+    """
     t0 = time.time()
     strPathIn, strPathOut, intCells, strComment = lstargs
-    MinX = str((int(strX) -        intBuf + fltCellSize*intCellSizeMult ))
-    MinY = str((int(strY) -        intBuf + fltCellSize*intCellSizeMult ))
-    MaxX = str((int(strX) + 1000 + intBuf - fltCellSize*intCellSizeMult ))
-    MaxY = str((int(strY) + 1000 + intBuf - fltCellSize*intCellSizeMult ))
-    strBND = ' '.join([MinX,MaxY,MaxX,MinY])
-    arcpy.Clip_management(strPathIn, strBND, strPathOut)
+    raster.CropASCII(strPathIn, strPathOut, intCells)
     t = elapsed_time(t0)
     return strComment + ", " + t
     
@@ -98,31 +103,77 @@ def CropRaster(lstargs):
 ##            print j
 ##    return strComment
 
-def DoPool(lstTasks, intWorkers):
-    # Create queues
+def StartWorker():
+    connParent, connChild = Pipe()
+    proc = Process(target=worker, args=(connChild,))
+    proc.start()
+    connChild.close()
+    return proc, connParent
+
+def DoPool(lstTasks, intWorkers, intCrashRetries = 1):
+    """ run (func, args) tasks on intWorkers processes.
+        A dead worker (OOM killer, segfault) is replaced and its task requeued
+        up to intCrashRetries times, then reported instead of waiting forever.
+    """
     print('\n\t\t' + str(len(lstTasks)) + ' task(s) found.')
-    #print '\t\tMaking empty queues'
-    task_queue = Queue()
-    done_queue = Queue()
-
-    # Submit tasks
-    #print '\t\tFilling queue with tasks'
-    for task in lstTasks:
-        task_queue.put(task)
+    lstWaiting = range(len(lstTasks))   # task indices not yet handed out
 
     # Start worker processes
     print('\t\tStarting ' + str(intWorkers) + " workers")
-    for i in range(intWorkers):
-        Process(target=worker, args=(task_queue, done_queue)).start()
+    lstWorkers = [StartWorker() for j in range(intWorkers)]
+    lstBusy = [None] * intWorkers       # task index held by each worker
 
     # Get and print results
     print('\t\tUnordered results:')
-    for i in range(len(lstTasks)):
-        print('\t\t\t' + done_queue.get())
+    dicCrashes = {}     # task index: worker deaths
+    intDone = 0
+    while intDone < len(lstTasks):
+        # hand tasks to idle workers
+        for j in range(intWorkers):
+            if lstBusy[j] is None and lstWaiting:
+                i = lstWaiting.pop(0)
+                func, args = lstTasks[i]
+                lstWorkers[j][1].send((i, func, args))
+                lstBusy[j] = i
+
+        bolIdle = True
+        for j, (proc, conn) in enumerate(lstWorkers):
+            if lstBusy[j] is None:
+                continue
+            bolDead = not proc.is_alive()
+            if conn.poll():
+                try:
+                    i, result = conn.recv()
+                    print('\t\t\t' + result)
+                    lstBusy[j] = None
+                    intDone += 1
+                    bolIdle = False
+                    continue
+                except (EOFError, IOError):
+                    bolDead = True
+            if bolDead:
+                # replace the dead worker, requeue or report its task
+                proc.join()
+                i = lstBusy[j]
+                conn.close()
+                lstWorkers[j] = StartWorker()
+                lstBusy[j] = None
+                dicCrashes[i] = dicCrashes.get(i, 0) + 1
+                strMsg = 'WORKER DIED (exit code ' + str(proc.exitcode) + ') running task ' + str(i)
+                if dicCrashes[i] <= intCrashRetries:
+                    print('\t\t\t' + strMsg + ', requeued')
+                    lstWaiting.insert(0, i)
+                else:
+                    print('\t\t\t' + strMsg)
+                    intDone += 1
+                bolIdle = False
+        if bolIdle:
+            time.sleep(0.01)
 
     # Tell child processes to stop
     print('\t\tStop workers')
-    for i in range(intWorkers):
-        task_queue.put('STOP')
+    for proc, conn in lstWorkers:
+        conn.send('STOP')
+        conn.close()
 
     print('\t\tPool Done\n')
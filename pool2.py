@@ -1,5 +1,21 @@
-import traceback, sys, os, time, multiprocessing, pickle, subprocess
+import traceback, sys, os, time, multiprocessing, pickle, subprocess, copy, json, hashlib
+import threading, Queue, csv, collections, signal, tempfile, math, errno
 import general as gen
+try:
+    import sqlite3
+except ImportError:
+    # only needed for MP_ResultStore
+    sqlite3 = None
+try:
+    import numpy
+except ImportError:
+    # only needed for shared array results (MP_SharedArray)
+    numpy = None
+try:
+    import resource
+except ImportError:
+    # not available on Windows, resource use then records I/O only where /proc exists
+    resource = None
 
 # ----------------------------------------
 # worker and wrapper functions
@@ -9,37 +25,269 @@ def worker(qInput, qOutput):
         R = fWrap(TS)
         qOutput.put(R)
 
+def poolworker(conn):
+    ''' MP_Pool worker function: runs (ID, TaskSet) messages received on its
+        own pipe conn until 'STOP', sending back (ID, MP_ResultSet).
+        A pipe per worker (rather than shared queues) means a worker killed
+        mid-message cannot leave a lock held that stalls the other workers. '''
+    if os.name != 'nt':
+        # pool time limit: take running commands down with the worker
+        signal.signal(signal.SIGTERM, TermHandler)
+    for ID, TS in iter(conn.recv, 'STOP'):
+        conn.send((ID, fWrap(TS)))
+
 def fWrap(TaskSet):
-    ''' Wrapper for passed functions. Organizes results, timing and exceptions into MP_ResultSet objects.'''
+    ''' Wrapper for passed functions. Organizes results, timing and exceptions into MP_ResultSet objects.
+        A failed task ends the set, unless TaskSet.isolate is set: then the
+        remaining tasks still run (each result records its own error).'''
     try:
         iResultSet = MP_ResultSet(TaskSet.comment)
+        iResultSet.predicted = getattr(TaskSet, 'cost', None)
+        bolIsolate = getattr(TaskSet, 'isolate', False)
         t0 = time.time()
         for task in TaskSet.tasks:
             
             iResult = MP_Result(task.comment, task.args)
             t1 = time.time()
+            dicUse0 = ResourceSnapshot(True)
             
-            # call function
-            args = task.args
-            f = task.func
-            r = f(*args)
-            iResult.result = r
+            try:
+                # call function, under the task's timeout and retry policy
+                r = CallTask(task, iResult)
+                if getattr(TaskSet, 'share', None):
+                    r = ShareArrays(r, *TaskSet.share)
+                iResult.result = r
+            except Exception:
+                exc_type, exc_value, exc_traceback = sys.exc_info()
+                strTrace = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
+                print(strTrace)
+                iResult.error = strTrace
+                iResultSet.hasError = True
             iResult.time = time.time() - t1
+            iResult.usage = ResourceUsage(dicUse0)
             iResultSet.addResult(iResult)
-
-    except Exception:
-        exc_type, exc_value, exc_traceback = sys.exc_info()
-        strTrace = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
-        print(strTrace)
-        iResult.error = strTrace
-        iResultSet.addResult(iResult)
-        iResultSet.hasError = True
+            if iResult.error and not bolIsolate:
+                break
         
     finally:
         # record timing and return resultset object.
         iResultSet.time = time.time() - t0
         return iResultSet
 
+# ----------------------------------------
+# timeouts and retries
+class SubmitError(Exception):
+    ''' a submitted command failed. returncode: its exit code, if it ran. '''
+    def __init__(self, message, returncode = None):
+        Exception.__init__(self, message)
+        self.returncode = returncode
+
+class TaskTimeout(Exception):
+    ''' an MP_Task or submitted command ran past its timeout. '''
+    pass
+
+class MP_Retry:
+    ''' retry policy for MP_Task: up to intAttempts calls, waiting fltBackoff
+        seconds after the first failure, multiplied by fltFactor after each
+        further one. A failure is retried if it is an instance of tupExceptions;
+        a SubmitError with an exit code must also have it in lstExitCodes, when given.
+            MP_Task(submit, [strCmd, strPathOut], strTile, timeout = 1800,
+                    retry = MP_Retry(3, 30, lstExitCodes = [1]))
+    '''
+    def __init__(self, intAttempts = 3, fltBackoff = 5.0, fltFactor = 2.0,
+                 tupExceptions = (TaskTimeout, SubmitError, IOError, OSError), lstExitCodes = None):
+        self.attempts = intAttempts
+        self.backoff = fltBackoff
+        self.factor = fltFactor
+        self.exceptions = tupExceptions
+        self.exitcodes = lstExitCodes
+
+    def retryable(self, e):
+        if not isinstance(e, self.exceptions):
+            return False
+        if isinstance(e, SubmitError) and e.returncode is not None and self.exitcodes is not None:
+            return e.returncode in self.exitcodes
+        return True
+
+    def delay(self, intAttempt):
+        ''' wait in seconds after failed attempt intAttempt (1 based). '''
+        return self.backoff * self.factor ** (intAttempt - 1)
+
+    def totalDelay(self):
+        return sum([self.delay(i) for i in range(1, self.attempts)])
+
+# deadline of the task running in this worker, used by submit; and process
+# groups of running commands, killed with the worker
+dicRunning = {'deadline': None}
+setChildren = set()
+
+def AlarmHandler(signum, frame):
+    raise TaskTimeout('Task exceeded its timeout.')
+
+def TermHandler(signum, frame):
+    for pid in list(setChildren):
+        KillTree(pid)
+    os._exit(1)
+
+def KillTree(pid):
+    ''' kill process pid and its descendants: its process group on posix
+        (commands are started as group leaders), taskkill /T on Windows. '''
+    try:
+        if os.name == 'nt':
+            with open(os.devnull, 'w') as devnull:
+                subprocess.call('taskkill /T /F /PID ' + str(pid), stdout = devnull, stderr = devnull)
+        else:
+            os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+def CallWithTimeout(func, args, fltTimeout):
+    ''' return func(*args), raising TaskTimeout after fltTimeout seconds.
+        Python code is interrupted by SIGALRM where available (posix, main
+        thread); submitted commands also honour the deadline themselves.
+    '''
+    if not fltTimeout:
+        return func(*args)
+    bolAlarm = hasattr(signal, 'setitimer') and threading.current_thread().name == 'MainThread'
+    dicRunning['deadline'] = time.time() + fltTimeout
+    if bolAlarm:
+        handlerOld = signal.signal(signal.SIGALRM, AlarmHandler)
+        signal.setitimer(signal.ITIMER_REAL, fltTimeout)
+    try:
+        return func(*args)
+    finally:
+        dicRunning['deadline'] = None
+        if bolAlarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, handlerOld)
+
+def CallTask(task, iResult):
+    ''' call task.func(*task.args) under task.timeout and task.retry, recording
+        each attempt in iResult.attempts. Raises the last failure. '''
+    fltTimeout = getattr(task, 'timeout', None)
+    retry = getattr(task, 'retry', None)
+    intAttempts = retry.attempts if retry else 1
+    for intAttempt in range(1, intAttempts + 1):
+        t0 = time.time()
+        try:
+            r = CallWithTimeout(task.func, task.args, fltTimeout)
+            iResult.attempts.append({'attempt': intAttempt, 'time': time.time() - t0, 'error': None})
+            return r
+        except Exception as e:
+            iResult.attempts.append({'attempt': intAttempt, 'time': time.time() - t0, 'error': repr(e)})
+            if intAttempt == intAttempts or not retry.retryable(e):
+                raise
+            print('Attempt ' + str(intAttempt) + ' of ' + str(task.comment) + ' failed, retrying: ' + repr(e))
+            time.sleep(retry.delay(intAttempt))
+
+def RunTree(cmd, timeout = None):
+    ''' run command string cmd through the shell and return its exit code.
+        The command leads its own process group, killed as a whole when
+        timeout (or the running MP_Task's deadline) passes, raising
+        TaskTimeout, or when the caller is interrupted.
+    '''
+    fltDeadline = dicRunning['deadline']
+    if timeout:
+        fltDeadline = min(fltDeadline or time.time() + timeout, time.time() + timeout)
+    if os.name == 'nt':
+        proc = subprocess.Popen(cmd, shell = True, creationflags = getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0))
+    else:
+        proc = subprocess.Popen(cmd, shell = True, preexec_fn = os.setsid)
+    setChildren.add(proc.pid)
+    try:
+        while proc.poll() is None:
+            if fltDeadline and time.time() > fltDeadline:
+                raise TaskTimeout('Command timed out: ' + cmd)
+            time.sleep(0.05)
+        return proc.returncode
+    finally:
+        if proc.poll() is None:
+            KillTree(proc.pid)
+            proc.wait()
+        setChildren.discard(proc.pid)
+
+# ----------------------------------------
+# resource accounting
+# cumulative counters of the worker process and its waited for children,
+# differenced around each task by fWrap into MP_Result.usage
+lstUsageFields = ['cpu_user', 'cpu_sys', 'child_cpu_user', 'child_cpu_sys',
+                  'read_bytes', 'write_bytes', 'maxrss_kb', 'worker_maxrss_kb', 'child_maxrss_kb']
+# high-water marks, reported as is rather than differenced:
+#   maxrss_kb: peak RSS of the task itself (Linux, peak reset per task)
+#   worker_maxrss_kb: where the peak cannot be reset instead, peak RSS of the
+#                     worker over its life so far, which on a warm MP_Pool
+#                     worker may be that of an earlier task
+#   child_maxrss_kb: largest waited for child of the worker so far
+lstPeakFields = ['maxrss_kb', 'worker_maxrss_kb', 'child_maxrss_kb']
+
+def ResetPeakRSS():
+    ''' reset the peak RSS (VmHWM) of this process, Linux 4.0 and later.
+        Returns True if done. '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+def PeakRSS():
+    ''' return the peak RSS (VmHWM, kB) of this process from /proc, or None. '''
+    try:
+        with open('/proc/self/status') as f:
+            for strLine in f:
+                if strLine.startswith('VmHWM:'):
+                    return int(strLine.split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+def ResourceSnapshot(bolResetPeak = False):
+    ''' return a dictionary of cumulative resource use of this process and its
+        waited for child processes (external tools run by submit). CPU and peak
+        RSS come from resource.getrusage, storage I/O from /proc/self/io, which
+        includes reaped children. Fields are missing where unavailable.
+        bolResetPeak: reset the process peak RSS (ResetPeakRSS), so
+                      ResourceUsage can report the peak of this task alone.
+    '''
+    dicUse = {}
+    if bolResetPeak and ResetPeakRSS():
+        dicUse['peak_reset'] = True
+    if resource:
+        rSelf = resource.getrusage(resource.RUSAGE_SELF)
+        rChild = resource.getrusage(resource.RUSAGE_CHILDREN)
+        dicUse['cpu_user'] = rSelf.ru_utime
+        dicUse['cpu_sys'] = rSelf.ru_stime
+        dicUse['child_cpu_user'] = rChild.ru_utime
+        dicUse['child_cpu_sys'] = rChild.ru_stime
+        dicUse['worker_maxrss_kb'] = rSelf.ru_maxrss
+        dicUse['child_maxrss_kb'] = rChild.ru_maxrss
+    try:
+        with open('/proc/self/io') as f:
+            for strLine in f:
+                strKey, strVal = strLine.split(':')
+                if strKey in ('read_bytes', 'write_bytes'):
+                    dicUse[strKey] = int(strVal)
+    except (IOError, OSError, ValueError):
+        pass
+    return dicUse
+
+def ResourceUsage(dicUse0):
+    ''' return resource use since ResourceSnapshot dicUse0. maxrss_kb is
+        recorded if dicUse0 reset the peak RSS, otherwise worker_maxrss_kb. '''
+    dicUse1 = ResourceSnapshot()
+    dicUse = {}
+    for strKey, val in dicUse1.items():
+        if strKey in lstPeakFields:
+            dicUse[strKey] = val
+        elif strKey in dicUse0:
+            dicUse[strKey] = val - dicUse0[strKey]
+    if dicUse0.get('peak_reset'):
+        intPeak = PeakRSS()
+        if intPeak is not None:
+            dicUse['maxrss_kb'] = intPeak
+            dicUse.pop('worker_maxrss_kb', None)
+    return dicUse
+
 def Range2(i, j):
     ''' dummy test function '''
     time.sleep(j)
@@ -50,23 +298,26 @@ def test_args(a, b= '2'):
     time.sleep(a/2)
     return str(a) + str(b)
 
-def submit(cmd, output = None):
+def submit(cmd, output = None, timeout = None):
     ''' Submit a command string to the command prompt.
         optional output will be checked for existance if given and returned if true.
+        timeout (s), or the running MP_Task's timeout: the command's process
+        tree is killed and TaskTimeout raised when exceeded.
+        Failures raise SubmitError carrying the exit code.
     '''
     # if output exists, skip cmd and return output 
     if output and os.path.exists(output):
         print('Output already present.')
         return output
         
-    r = os.system(cmd)
+    r = RunTree(cmd, timeout)
     if output:
         if not os.path.exists(output):
-            raise Exception('Output not created: ' + output)
+            raise SubmitError('Output not created: ' + output, r)
         return output
     else:
         if r:
-            raise Exception('Nonzero exit status.')
+            raise SubmitError('Nonzero exit status ' + str(r) + '.', r)
         return 'submit'
 
 def POpen(cmd, output = None):
@@ -91,32 +342,258 @@ def POpen(cmd, output = None):
 # task classes
     
 class MP_Task:
-    ''' class to hold multiprocessing worker tasks. to be placed into MP_taskset. '''
-    def __init__(self, func, args, comment = None):
+    ''' class to hold multiprocessing worker tasks. to be placed into MP_taskset.
+        timeout: seconds per attempt, see CallWithTimeout. The pool also kills
+                 a worker (and its commands) that overruns all its tasks'
+                 attempts, as a last resort.
+        retry: optional MP_Retry policy
+    '''
+    def __init__(self, func, args, comment = None, timeout = None, retry = None):
         self.func = func
         self.args = args
         self.comment = comment
+        self.timeout = timeout
+        self.retry = retry
+        self.cost = None    # optional estimate of run time (s), see MP_CostModel
+
+    def timeLimit(self):
+        ''' longest time all attempts may take, or None without a timeout. '''
+        if not getattr(self, 'timeout', None):
+            return None
+        retry = getattr(self, 'retry', None)
+        if retry is None:
+            return self.timeout
+        return self.timeout * retry.attempts + retry.totalDelay()
 
     def __str__(self):
         strPrint = 'MP_Task: ' + self.func.__name__ 
         return strPrint
 
 class MP_TaskSet:
-    ''' class to bundle MP_Task instances. '''
+    ''' class to bundle MP_Task instances.
+        A task set may depend on other task sets, explicitly (addDependency) or
+        through MP_Ref placeholders in its task args. The pool submits it only
+        once those have completed, and skips it (recording an error) if any failed.
+    '''
     def __init__(self, comment = None):
         self.tasks = []
         self.count = 0
         self.comment = comment
+        self.cost = None    # predicted run time (s), set by MP_CostModel.order
+        self.memory = None  # estimated peak memory (MB), for adaptive pools
+        self.isolate = False    # run remaining tasks after one fails, see fWrap
+        self.depends = []   # MP_TaskSets that must complete first
+        self.resultSet = None   # MP_ResultSet once run by a pool
 
     def addTask(self, task):
         self.tasks.append(task)
         self.count += 1
 
+    def addDependency(self, TaskSet):
+        self.depends.append(TaskSet)
+
+    def timeLimit(self):
+        ''' longest time the set may take, or None if a task has no timeout. '''
+        lstLimits = [task.timeLimit() for task in self.tasks]
+        if None in lstLimits:
+            return None
+        return sum(lstLimits)
+
+    def dependencies(self):
+        ''' return the MP_TaskSets this set depends on, explicit and via MP_Refs. '''
+        lstDeps = list(getattr(self, 'depends', []))
+        for task in self.tasks:
+            for ref in FindRefs(task.args):
+                if ref.TaskSet not in lstDeps:
+                    lstDeps.append(ref.TaskSet)
+        return lstDeps
+
+    def dependencyState(self):
+        ''' return 'ready', 'wait' (a dependency has not run) or 'failed'. '''
+        strState = 'ready'
+        for TS in self.dependencies():
+            rs = getattr(TS, 'resultSet', None)
+            if rs is None:
+                strState = 'wait'
+            elif rs.hasError:
+                return 'failed'
+        return strState
+
+    def resolved(self):
+        ''' return a copy for dispatch: MP_Refs in task args replaced by the
+            upstream results, dependencies dropped. '''
+        TS = copy.copy(self)
+        TS.depends = []
+        TS.resultSet = None
+        TS.tasks = []
+        for task in self.tasks:
+            t = copy.copy(task)
+            t.args = ResolveRefs(task.args)
+            TS.tasks.append(t)
+        return TS
+
     def __str__(self):
         strPrint = 'MP_TaskSet: [' + ', '.join([t.func.__name__ for t in self.tasks]) + ']'
         return strPrint
+
+class MP_Ref:
+    ''' placeholder for the result of task intTask of MP_TaskSet TaskSet, used in
+        MP_Task args and replaced by that result when the dependent set is dispatched.
+            tsGround = MP_TaskSet('ground ' + strTile)
+            tsGround.addTask(MP_Task(submit, [strGroundCmd, strPathGround]))
+            tsDTM = MP_TaskSet('dtm ' + strTile)
+            tsDTM.addTask(MP_Task(MakeDTM, [MP_Ref(tsGround), strPathDTM]))
+    '''
+    def __init__(self, TaskSet, intTask = -1):
+        self.TaskSet = TaskSet
+        self.intTask = intTask
+
+    def value(self):
+        rs = self.TaskSet.resultSet
+        if rs is None:
+            raise Exception('MP_Ref to a task set that has not run: ' + str(self.TaskSet.comment))
+        return rs.results[self.intTask].result
+
+    def __str__(self):
+        return 'MP_Ref: ' + str(self.TaskSet.comment) + '[' + str(self.intTask) + ']'
+
+def FindRefs(args):
+    ''' return the MP_Refs in args, searching lists, tuples and dictionaries. '''
+    if isinstance(args, MP_Ref):
+        return [args]
+    if isinstance(args, dict):
+        args = args.values()
+    if isinstance(args, (list, tuple)):
+        return [ref for arg in args for ref in FindRefs(arg)]
+    return []
+
+def ResolveRefs(args):
+    ''' return args with each MP_Ref replaced by its value. '''
+    if isinstance(args, MP_Ref):
+        return args.value()
+    if isinstance(args, dict):
+        return dict([(k, ResolveRefs(v)) for k, v in args.items()])
+    if isinstance(args, (list, tuple)):
+        return type(args)([ResolveRefs(arg) for arg in args])
+    return args
+
+def ErrorResultSet(TaskSet, strID, strError):
+    ''' MP_ResultSet recording error strError for a TaskSet the pool could not run. '''
+    iResultSet = MP_ResultSet(TaskSet.comment)
+    iResult = MP_Result(strID, [])
+    iResult.error = strError
+    iResultSet.addResult(iResult)
+    iResultSet.hasError = True
+    return iResultSet
+
+def SkippedResultSet(TaskSet):
+    ''' MP_ResultSet recording that TaskSet was not run because a dependency failed. '''
+    lstFailed = [str(TS.comment) for TS in TaskSet.dependencies() if TS.resultSet is not None and TS.resultSet.hasError]
+    return ErrorResultSet(TaskSet, 'dependency', 'Skipped, dependency failed: ' + ', '.join(lstFailed))
     
 
+# ----------------------------------------
+# shared array results
+def ShareDir():
+    ''' scratch directory for shared arrays: /dev/shm (memory backed) where
+        available, else the temp directory. '''
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+def PidAlive(pid):
+    ''' True if process pid is running (or cannot be checked). '''
+    if os.name == 'nt':
+        # os.kill would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        intCode = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(intCode))
+        kernel32.CloseHandle(handle)
+        return intCode.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+def SweepShared(strDir, strPrefix = None):
+    ''' delete shared array scratch files in strDir: those named with
+        strPrefix, or if None those of parent processes no longer running
+        (MP_Pool names them mp_share_<parent pid>_<pool>_...). '''
+    try:
+        lstNames = os.listdir(strDir)
+    except OSError:
+        return
+    for strName in lstNames:
+        if not strName.startswith('mp_share_'):
+            continue
+        if strPrefix is not None:
+            if not strName.startswith(strPrefix):
+                continue
+        else:
+            strPid = strName.split('_')[2]
+            if not strPid.isdigit() or PidAlive(int(strPid)):
+                continue
+        try:
+            os.remove(os.path.join(strDir, strName))
+        except OSError:
+            pass
+
+class MP_SharedArray:
+    ''' handle to an array result written by a worker to a scratch .npy file.
+        Only the handle travels back through the pipe; the parent maps the
+        file read only (load) instead of unpickling a copy.
+    '''
+    def __init__(self, strPath, shape, dtype):
+        self.path = strPath
+        self.shape = shape
+        self.dtype = dtype
+
+    def __str__(self):
+        return 'MP_SharedArray: ' + self.path + ', ' + str(self.shape) + ' ' + str(self.dtype)
+
+    def load(self):
+        return numpy.load(self.path, mmap_mode = 'r')
+
+def ShareArrays(obj, intBytes, strDir, strPrefix = 'mp_share_'):
+    ''' worker side: return obj with numpy arrays of intBytes or more (also
+        inside lists, tuples and dictionaries) saved to strDir, in files
+        named strPrefix..., and replaced by MP_SharedArray handles. '''
+    if numpy is None:
+        return obj
+    if isinstance(obj, numpy.ndarray):
+        if obj.nbytes < intBytes or obj.dtype.hasobject:
+            return obj
+        fd, strPath = tempfile.mkstemp('.npy', strPrefix, strDir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                numpy.save(f, obj)
+        except Exception:
+            os.remove(strPath)
+            raise
+        return MP_SharedArray(strPath, obj.shape, obj.dtype.str)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)([ShareArrays(v, intBytes, strDir, strPrefix) for v in obj])
+    if isinstance(obj, dict):
+        return dict([(k, ShareArrays(v, intBytes, strDir, strPrefix)) for k, v in obj.items()])
+    return obj
+
+def MapArrays(obj, lstPaths):
+    ''' parent side: return obj with MP_SharedArray handles replaced by read
+        only memmaps of their files, appending the file paths to lstPaths. '''
+    if isinstance(obj, MP_SharedArray):
+        lstPaths.append(obj.path)
+        return obj.load()
+    if isinstance(obj, (list, tuple)):
+        return type(obj)([MapArrays(v, lstPaths) for v in obj])
+    if isinstance(obj, dict):
+        return dict([(k, MapArrays(v, lstPaths)) for k, v in obj.items()])
+    return obj
+
 # ----------------------------------------
 # result classes
 class MP_Result:
@@ -127,6 +604,8 @@ class MP_Result:
         self.result = None
         self.time = 0
         self.error = None
+        self.usage = {}     # resource use, see ResourceSnapshot
+        self.attempts = []  # dictionary per attempt: attempt, time, error
         
     def __str__(self):
         strT = gen.time_string(self.time)
@@ -142,17 +621,45 @@ class MP_ResultSet:
         self.count = 0
         self.ID = strID # like old 'strComment'
         self.time = 0
+        self.predicted = None
+        self.journaled = False  # restored from an MP_Journal, not run
         self.hasError = False
+        self.shared = []        # scratch files of shared array results
 
     def addResult(self, result):
         self.results.append(result)
         self.count += 1
+
+    def __getstate__(self):
+        # the scratch files belong to this object: a pickled copy (PoolResults.Pickle,
+        # MP_CostModel.load) must not delete them when it is discarded
+        dicState = self.__dict__.copy()
+        dicState['shared'] = []
+        return dicState
+
+    def mapShared(self):
+        ''' map shared array results (MP_SharedArray) into the results. '''
+        for r in self.results:
+            r.result = MapArrays(r.result, self.shared)
+
+    def release(self):
+        ''' delete the scratch files of shared array results. Arrays already
+            mapped stay readable on Linux; on Windows files still mapped
+            cannot be deleted and are left behind. '''
+        for strPath in getattr(self, 'shared', []):
+            try:
+                os.remove(strPath)
+            except OSError:
+                pass
+        self.shared = []
         
     def __str__(self):
         strT = gen.time_string(self.time)
         strPrint = str(self.ID) + ", " + strT
         if self.hasError:
             strPrint += ', EXCEPTION recorded.'
+        if getattr(self, 'journaled', False):
+            strPrint += ', from journal.'
         return strPrint
 
 class PoolResults:
@@ -163,10 +670,21 @@ class PoolResults:
         self.ResultSets = []
         self.Count = 0
         self.ErrorCount = 0
+        self.predictedRuntime = None
 
     def __len__(self):
         return self.Count
 
+    def __del__(self):
+        self.release()
+
+    def release(self):
+        ''' delete the scratch files of shared array results (MP_Pool
+            intShareBytes), also done when the PoolResults is discarded. '''
+        for rs in self.ResultSets:
+            if hasattr(rs, 'release'):
+                rs.release()
+
     def __str__(self):
         strText = 'PoolResult object\n\tWorkers: ' + str(self.workers) + \
                   '\n\tTaskSets: ' + str(self.Count) + \
@@ -215,50 +733,1206 @@ class PoolResults:
         else:
             return [[r.result for r in rs.results] for rs in self.ResultSets]
 
+    def summary(self):
+        ''' return a dictionary of aggregate timing and resource use:
+            tasktime: summed task wall time
+            cputime: summed cpu time (user + sys) of tasks and their children
+            utilization: tasktime / (runtime * workers)
+            cpu_utilization: cputime / (runtime * workers), low values with high
+                             utilization point to I/O or waiting
+            read_bytes, write_bytes: summed storage I/O
+            maxrss_kb: highest peak RSS of a worker or a child process
+        '''
+        lstResults = [r for rs in self.ResultSets if not getattr(rs, 'journaled', False) for r in rs.results]
+        fltCapacity = self.runtime * self.workers
+        dicSum = {'tasksets': self.Count,
+                  'tasks': len(lstResults),
+                  'errors': self.ErrorCount,
+                  'workers': self.workers,
+                  'runtime': self.runtime,
+                  'tasktime': sum([r.time for r in lstResults]),
+                  'cputime': 0.0,
+                  'read_bytes': 0,
+                  'write_bytes': 0,
+                  'maxrss_kb': 0}
+        for r in lstResults:
+            dicUse = getattr(r, 'usage', {})
+            dicSum['cputime'] += sum([dicUse.get(k, 0) for k in lstUsageFields[:4]])
+            dicSum['read_bytes'] += dicUse.get('read_bytes', 0)
+            dicSum['write_bytes'] += dicUse.get('write_bytes', 0)
+            dicSum['maxrss_kb'] = max([dicSum['maxrss_kb']] + [dicUse.get(k, 0) for k in lstPeakFields])
+        dicSum['utilization'] = dicSum['tasktime'] / fltCapacity if fltCapacity else 0.0
+        dicSum['cpu_utilization'] = dicSum['cputime'] / fltCapacity if fltCapacity else 0.0
+        return dicSum
+
+    def printSummary(self):
+        dicSum = self.summary()
+        print(self)
+        print('\tTask time: ' + gen.time_string(dicSum['tasktime']) + ', CPU time: ' + gen.time_string(dicSum['cputime']))
+        print('\tUtilization: ' + str(round(100 * dicSum['utilization'], 1)) + '%, CPU: ' + str(round(100 * dicSum['cpu_utilization'], 1)) + '%')
+        print('\tI/O: ' + str(round(dicSum['read_bytes'] / 2.0 ** 20, 1)) + ' MB read, ' + str(round(dicSum['write_bytes'] / 2.0 ** 20, 1)) + ' MB written')
+        print('\tPeak RSS: ' + str(round(dicSum['maxrss_kb'] / 1024.0, 1)) + ' MB')
+        lstSlow = self.stragglers()
+        if lstSlow:
+            print('\tStragglers: ' + ', '.join([str(r.ID) + ' (' + gen.time_string(r.time) + ')' for rs, r in lstSlow]))
+
+    def stragglers(self, fltFactor = 2.0):
+        ''' return (result set, result) pairs of tasks taking more than fltFactor
+            times the median task time, slowest first. '''
+        lstPairs = [(rs, r) for rs in self.ResultSets if not getattr(rs, 'journaled', False) for r in rs.results]
+        if not lstPairs:
+            return []
+        lstTimes = sorted([r.time for rs, r in lstPairs])
+        fltMedian = lstTimes[len(lstTimes) // 2]
+        lstSlow = [(rs, r) for rs, r in lstPairs if r.time > fltFactor * fltMedian]
+        return sorted(lstSlow, key = lambda pair: -pair[1].time)
+
+    def rows(self):
+        ''' return a dictionary per MP_Result: IDs, time, error flag and resource use. '''
+        lstRows = []
+        for rs in self.ResultSets:
+            for r in rs.results:
+                dicRow = {'resultset': rs.ID, 'task': r.ID, 'time': r.time, 'error': r.error is not None}
+                for strKey in lstUsageFields:
+                    dicRow[strKey] = getattr(r, 'usage', {}).get(strKey)
+                lstRows.append(dicRow)
+        return lstRows
+
+    def exportCSV(self, strPathCSV):
+        ''' write one row per MP_Result (see rows) to strPathCSV. '''
+        lstFields = ['resultset', 'task', 'time', 'error'] + lstUsageFields
+        with open(strPathCSV, 'wb') as f:
+            writer = csv.DictWriter(f, lstFields)
+            writer.writerow(dict(zip(lstFields, lstFields)))
+            writer.writerows(self.rows())
+        return strPathCSV
+
+    def exportJSON(self, strPathJSON):
+        ''' write the summary, stragglers and per result rows to strPathJSON. '''
+        dicOut = {'summary': self.summary(),
+                  'stragglers': [[rs.ID, r.ID, r.time] for rs, r in self.stragglers()],
+                  'results': self.rows()}
+        with open(strPathJSON, 'w') as f:
+            json.dump(dicOut, f, indent = 1, default = repr)
+        return strPathJSON
+
+    def printPredicted(self):
+        ''' print predicted (MP_CostModel) vs actual time of each result set. '''
+        lstRS = [rs for rs in self.ResultSets if rs.predicted is not None]
+        if not lstRS:
+            print('\tNo predictions recorded.')
+            return
+        for rs in sorted(lstRS, key = lambda rs: -rs.predicted):
+            print('\t' + str(rs.ID) + ': predicted ' + gen.time_string(rs.predicted) + ', actual ' + gen.time_string(rs.time))
+        fltPredicted = sum([rs.predicted for rs in lstRS])
+        fltActual = sum([rs.time for rs in lstRS])
+        print('\tTotal: predicted ' + gen.time_string(fltPredicted) + ', actual ' + gen.time_string(fltActual))
+        if getattr(self, 'predictedRuntime', None) is not None:
+            print('\tPool runtime: predicted ' + gen.time_string(self.predictedRuntime) + ', actual ' + gen.time_string(self.runtime))
+
     def Pickle(self, strTXT):
         ''' go pickle (your)self '''
         with open(strTXT, 'wb') as f:
             pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
                 
         
-def DoPool(lstTasks, intWorkers, txtPickle = None):
-    # Create queues and result object
-    print('\n\tStart Pool:')
-    print('\t\t' + str(len(lstTasks)) + ' task(s).')
-    t0 = time.time()
-    task_queue = multiprocessing.Queue()
-    done_queue = multiprocessing.Queue()
-    iPoolResult = PoolResults(intWorkers)
-
-    # Submit tasks
-    #print '\t\tFilling queue with tasks'
-    for task in lstTasks:
-        task_queue.put(task)
-
-    # Start worker processes
-    print('\t\t' + str(intWorkers) + ' worker(s).')
-    for i in range(intWorkers):
-        multiprocessing.Process(target=worker, args=(task_queue, done_queue)).start()
-    
-    # Get and print results
-    print('\t\tUnordered results:')
-    for i in range(len(lstTasks)):
-        resultSet = done_queue.get()
-        print('\t\t\t' + str(resultSet))
-        iPoolResult.record(resultSet)
+# ----------------------------------------
+# scheduling
+def ArgBytes(args):
+    ''' return the summed size of existing files named in args, or in
+        whitespace separated tokens of string args (command strings). '''
+    intBytes = 0
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            intBytes += ArgBytes(arg)
+        elif isinstance(arg, basestring):
+            if os.path.isfile(arg):
+                intBytes += os.path.getsize(arg)
+            elif ' ' in arg:
+                for strTok in arg.split():
+                    strTok = strTok.strip('"\'')
+                    if os.path.isfile(strTok):
+                        intBytes += os.path.getsize(strTok)
+    return intBytes
+
+class MP_CostModel:
+    ''' predicts MP_Task / MP_TaskSet run times from earlier runs so the pool can
+        dispatch longest first. History is the time of each successful MP_Result,
+        keyed by task comment (or args when there is no comment), loaded from
+        PoolResults objects or their pickles. Tasks without history are
+        predicted from the size of the input files in their args at the
+        historical seconds per byte, otherwise the mean task time.
+            cm = MP_CostModel([r'C:\runs\ground_1.pkl', r'C:\runs\ground_2.pkl'])
+            pr = DoPool(lstTasks, 8, costModel = cm)
+            pr.printPredicted()
+    '''
+    def __init__(self, lstHistory = None):
+        self.times = {}         # task key: list of times
+        self.fltTime = 0.0      # summed time and bytes of tasks with input files
+        self.intBytes = 0
+        for history in lstHistory or []:
+            self.load(history)
+
+    def __str__(self):
+        return 'MP_CostModel: ' + str(len(self.times)) + ' task(s) in history'
 
-    # Tell child processes to stop
-    for i in range(intWorkers):
-        task_queue.put('STOP')
+    @staticmethod
+    def key(strComment, args):
+        if strComment is not None:
+            return strComment
+        return repr(args)
 
-    iPoolResult.runtime = time.time() - t0
+    def load(self, history):
+        ''' add the task times of a PoolResults object or pickle path. '''
+        if isinstance(history, basestring):
+            with open(history, 'rb') as f:
+                history = pickle.load(f)
+        for rs in history.ResultSets:
+            if getattr(rs, 'journaled', False):
+                continue
+            for r in rs.results:
+                if r.error:
+                    continue
+                self.times.setdefault(self.key(r.ID, r.args), []).append(r.time)
+                intBytes = ArgBytes(r.args)
+                if intBytes:
+                    self.fltTime += r.time
+                    self.intBytes += intBytes
+
+    def predictTask(self, task):
+        ''' predicted run time in seconds of MP_Task task. '''
+        if task.cost is not None:
+            return task.cost
+        lstTimes = self.times.get(self.key(task.comment, task.args))
+        if lstTimes:
+            return sum(lstTimes) / len(lstTimes)
+        if self.intBytes:
+            intBytes = ArgBytes(task.args)
+            if intBytes:
+                return intBytes * self.fltTime / self.intBytes
+        lstAll = [t for lst in self.times.values() for t in lst]
+        if lstAll:
+            return sum(lstAll) / len(lstAll)
+        return 0.0
+
+    def predict(self, TaskSet):
+        ''' predicted run time in seconds of MP_TaskSet TaskSet. '''
+        return sum([self.predictTask(task) for task in TaskSet.tasks])
 
-    if iPoolResult.ErrorCount:
-        print('\n\t\tPool done: WITH ERRORS!.\n')
+    def order(self, lstTasks):
+        ''' return MP_TaskSets lstTasks sorted longest predicted first, setting
+            each TaskSet.cost to its prediction. '''
+        for TS in lstTasks:
+            TS.cost = self.predict(TS)
+        return sorted(lstTasks, key = lambda TS: -TS.cost)
+
+    def makespan(self, lstTasks, intWorkers):
+        ''' predicted pool runtime of MP_TaskSets lstTasks dispatched in order
+            to intWorkers (each to the first free worker). '''
+        lstFree = [0.0] * intWorkers
+        for TS in lstTasks:
+            fltCost = TS.cost if TS.cost is not None else self.predict(TS)
+            i = lstFree.index(min(lstFree))
+            lstFree[i] += fltCost
+        return max(lstFree) if lstFree else 0.0
+
+# ----------------------------------------
+# task batching
+def BatchTasks(lstTasks, fltTarget = None, intSets = None, costModel = None, strComment = 'batch', bolIsolate = True):
+    ''' pack a flat list of MP_Tasks into MP_TaskSets of roughly equal cost,
+        so thousands of short tasks (lasindex, DTM2ASCII) do not each pay the
+        dispatch overhead, while long tasks stay alone.
+            fltTarget: cost per set, or
+            intSets: number of sets to aim for (fltTarget = total cost / intSets)
+            costModel: optional MP_CostModel giving task costs (seconds);
+                       otherwise MP_Task.cost if every task has one, else the
+                       size of the input files in the task args (ArgBytes)
+                       for all tasks, so fltTarget is then in bytes. One
+                       source is used for the whole list, never a mix of
+                       units. Tasks all costing 0 count 1 each.
+            bolIsolate: a failed task does not skip the rest of its set
+        Tasks costing fltTarget or more get a set of their own; the rest are
+        dealt longest first to the least loaded of ceil(cost / fltTarget) sets.
+        Tasks keep their list order within a set. Sets are returned longest
+        first; TaskSet.cost is set when costs are times (costModel or MP_Task.cost).
+            lstTS = BatchTasks(lstIndexTasks, intSets = 4 * intWorkers)
+    '''
+    if fltTarget is None and not intSets:
+        raise Exception('BatchTasks needs fltTarget or intSets.')
+    bolSeconds = True
+    if costModel:
+        lstCosts = [costModel.predictTask(task) for task in lstTasks]
+    elif all([getattr(task, 'cost', None) is not None for task in lstTasks]):
+        lstCosts = [task.cost for task in lstTasks]
     else:
-        print('\n\t\tPool done: ' + gen.time_string(iPoolResult.runtime) + '\n')
+        lstCosts = [ArgBytes(task.args) for task in lstTasks]
+        bolSeconds = False
+    if not any(lstCosts):
+        lstCosts = [1] * len(lstTasks)
+    if fltTarget is None:
+        fltTarget = sum(lstCosts) / float(intSets)
 
-    if txtPickle:
-        iPoolResult.Pickle(txtPickle)
-        
-    return iPoolResult
+    lstBins = []    # [cost, task indexes]
+    lstSmall = []
+    for i, fltCost in enumerate(lstCosts):
+        if fltCost >= fltTarget:
+            lstBins.append([fltCost, [i]])
+        else:
+            lstSmall.append(i)
+    if lstSmall:
+        fltSmall = sum([lstCosts[i] for i in lstSmall])
+        intBins = max(1, min(len(lstSmall), int(math.ceil(fltSmall / fltTarget))))
+        lstSmallBins = [[0.0, []] for b in range(intBins)]
+        for i in sorted(lstSmall, key = lambda i: -lstCosts[i]):
+            b = min(lstSmallBins, key = lambda b: b[0])
+            b[0] += lstCosts[i]
+            b[1].append(i)
+        lstBins += lstSmallBins
+
+    lstTS = []
+    lstBins.sort(key = lambda b: -b[0])
+    for intBin, (fltCost, lstIndex) in enumerate(lstBins):
+        TS = MP_TaskSet(strComment + ' ' + str(intBin))
+        for i in sorted(lstIndex):
+            TS.addTask(lstTasks[i])
+        if bolSeconds:
+            TS.cost = fltCost
+        TS.isolate = bolIsolate
+        lstTS.append(TS)
+    return lstTS
+
+# ----------------------------------------
+# checkpoint journal
+def ArgKey(arg):
+    ''' return a string identifying arg by value for MP_Journal.key: numpy
+        arrays by dtype, shape and a hash of their contents (their repr is
+        truncated), functions and classes by name. Raises ValueError for
+        objects with the default repr, which holds their address and so
+        changes every run. '''
+    # lists and tuples of plain values key as the repr of a list of str, the
+    # form MP_Ref results take when restored from the journal
+    if isinstance(arg, (list, tuple)):
+        return '[' + ', '.join([ArgKey(v) for v in arg]) + ']'
+    if isinstance(arg, unicode):
+        return repr(JSONStr(arg))
+    if isinstance(arg, dict):
+        return '{' + ', '.join(sorted([ArgKey(k) + ': ' + ArgKey(v) for k, v in arg.items()])) + '}'
+    if numpy is not None and isinstance(arg, numpy.ndarray):
+        if arg.dtype.hasobject:
+            return 'ndarray(' + str(arg.shape) + ', ' + ArgKey(arg.tolist()) + ')'
+        strHash = hashlib.sha1(numpy.ascontiguousarray(arg).data).hexdigest()
+        return 'ndarray(' + arg.dtype.str + ', ' + str(arg.shape) + ', ' + strHash + ')'
+    if hasattr(arg, '__name__') and hasattr(arg, '__module__'):
+        return str(arg.__module__) + '.' + arg.__name__
+    strRepr = repr(arg)
+    if ' at 0x' in strRepr or ' object at ' in strRepr:
+        raise ValueError('no stable journal key for ' + strRepr)
+    return strRepr
+
+def JSONStr(obj):
+    ''' return obj loaded from JSON with unicode strings encoded back to
+        utf-8 str, recursing into lists and dictionaries. '''
+    if isinstance(obj, unicode):
+        try:
+            return obj.encode('ascii')
+        except UnicodeError:
+            return obj.encode('utf-8')
+    if isinstance(obj, list):
+        return [JSONStr(v) for v in obj]
+    if isinstance(obj, dict):
+        return dict([(JSONStr(k), JSONStr(v)) for k, v in obj.items()])
+    return obj
+
+class MP_Journal:
+    ''' append-only journal of completed MP_TaskSets, one JSON line per set:
+        key (hash of comment, task functions and args), comment, outputs and time.
+        Pools given a journal record each successful set as it completes and
+        skip sets already recorded, so a run restarted after a crash resumes
+        without rerunning finished work or checking outputs on disk.
+        A partly written last line (crash mid write) is ignored.
+            lstForce: task set comments or keys to rerun regardless
+        Args are keyed by value (numpy arrays by their contents). Sets with
+        args that have no stable value, e.g. objects whose repr is their
+        address, are not journaled and always run.
+        Sets with results that are not JSON serializable are recorded but
+        always rerun, their outputs could not be restored. Restored outputs
+        come back as JSON gives them, strings as str and tuples as lists;
+        ArgKey keys tuples as lists so MP_Refs to restored sets key the same.
+            pr = DoPool(lstTasks, 8, journal = r'C:\runs\canopy.journal')
+    '''
+    def __init__(self, strPath, lstForce = None):
+        self.path = strPath
+        self.force = set(lstForce or [])
+        self.done = {}      # key: record
+        self.load()
+
+    def __str__(self):
+        return 'MP_Journal: ' + self.path + ', ' + str(len(self.done)) + ' completed set(s)'
+
+    @staticmethod
+    def key(TaskSet):
+        ''' hash identifying a (resolved) MP_TaskSet by comment, functions and
+            args, or None if an arg cannot be keyed (see ArgKey). '''
+        lstID = [repr(TaskSet.comment)]
+        try:
+            for task in TaskSet.tasks:
+                lstID.append(getattr(task.func, '__name__', repr(task.func)) + repr(task.comment) + ArgKey(task.args))
+        except ValueError:
+            return None
+        return hashlib.sha1('\n'.join(lstID)).hexdigest()
+
+    def load(self):
+        ''' read completed records, later lines replacing earlier ones. '''
+        self.done = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            for strLine in f:
+                try:
+                    dicRec = json.loads(strLine)
+                    self.done[dicRec['key']] = dicRec
+                except (ValueError, KeyError, TypeError):
+                    # partial or damaged line
+                    continue
+
+    def lookup(self, TaskSet, strKey = None):
+        ''' return the record of a completed TaskSet, or None if it must run. '''
+        if strKey is None:
+            strKey = self.key(TaskSet)
+        if strKey is None or TaskSet.comment in self.force or strKey in self.force:
+            return None
+        dicRec = self.done.get(strKey)
+        if dicRec is None or dicRec.get('outputs') is None:
+            return None
+        return dicRec
+
+    def record(self, TaskSet, resultSet, strKey = None):
+        ''' append a successful resultSet of TaskSet to the journal. '''
+        if resultSet.hasError:
+            return
+        if strKey is None:
+            strKey = self.key(TaskSet)
+        if strKey is None:
+            return
+        dicRec = {'key': strKey,
+                  'comment': TaskSet.comment,
+                  'tasks': [r.ID for r in resultSet.results],
+                  'times': [r.time for r in resultSet.results],
+                  'time': resultSet.time,
+                  'finished': time.time()}
+        try:
+            dicRec['outputs'] = [r.result for r in resultSet.results]
+            strLine = json.dumps(dicRec)
+        except (TypeError, ValueError):
+            dicRec['outputs'] = None
+            strLine = json.dumps(dicRec, default = repr)
+        # start on a fresh line if the last write was cut short
+        bolNewLine = False
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, 'rb') as f:
+                f.seek(-1, 2)
+                bolNewLine = f.read(1) != '\n'
+        with open(self.path, 'ab') as f:
+            if bolNewLine:
+                f.write('\n')
+            f.write(strLine + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.done[strKey] = dicRec
+
+    def resultSet(self, dicRec):
+        ''' rebuild the MP_ResultSet of journal record dicRec. '''
+        iResultSet = MP_ResultSet(dicRec['comment'])
+        for strID, fltTime, output in zip(dicRec['tasks'], dicRec['times'], dicRec['outputs']):
+            iResult = MP_Result(strID, [])
+            iResult.result = JSONStr(output)
+            iResult.time = fltTime
+            iResultSet.addResult(iResult)
+        iResultSet.time = dicRec['time']
+        iResultSet.journaled = True
+        return iResultSet
+
+# ----------------------------------------
+# result store
+class MP_ResultStore:
+    ''' SQLite store of pool results, written one MP_ResultSet at a time as
+        they arrive (so a crashed run keeps what finished) and queried without
+        loading whole runs or unpickling PoolResults. Each run gets an ID;
+        per result it records task ID, args, output (JSON, repr where not
+        serializable), time, error, resource use and attempts.
+            pr = DoPool(lstTasks, 8, store = r'C:\runs\canopy.sqlite')
+            rst = MP_ResultStore(r'C:\runs\canopy.sqlite')
+            rst.printErrors()
+            print(rst.failed(3))    # task sets failing in any of the last 3 runs
+        Query methods default to the latest run.
+    '''
+    lstSchema = ['CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY AUTOINCREMENT, '
+                 'started REAL, finished REAL, workers INTEGER, comment TEXT)',
+                 'CREATE TABLE IF NOT EXISTS resultsets (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                 'run INTEGER, seq INTEGER, name TEXT, time REAL, predicted REAL, '
+                 'error INTEGER, journaled INTEGER)',
+                 'CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                 'resultset INTEGER, run INTEGER, seq INTEGER, task TEXT, args TEXT, output TEXT, '
+                 'time REAL, error TEXT, usage TEXT, attempts TEXT)',
+                 'CREATE INDEX IF NOT EXISTS resultsets_run ON resultsets (run, seq)',
+                 'CREATE INDEX IF NOT EXISTS results_set ON results (resultset, seq)']
+
+    def __init__(self, strPath):
+        if sqlite3 is None:
+            raise Exception('MP_ResultStore needs the sqlite3 module.')
+        self.path = strPath
+        self.run = None     # run being recorded
+        self.seq = 0
+        self.conn = sqlite3.connect(strPath, timeout = 30)
+        self.conn.text_factory = str
+        for strSQL in self.lstSchema:
+            self.conn.execute(strSQL)
+        self.conn.commit()
+
+    def __str__(self):
+        intRuns = self.conn.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+        return 'MP_ResultStore: ' + self.path + ', ' + str(intRuns) + ' run(s)'
+
+    def close(self):
+        self.conn.close()
+
+    def startRun(self, intWorkers = None, strComment = None):
+        ''' start recording a new run, returns its ID. '''
+        cur = self.conn.execute('INSERT INTO runs (started, workers, comment) VALUES (?, ?, ?)',
+                                (time.time(), intWorkers, strComment))
+        self.conn.commit()
+        self.run = cur.lastrowid
+        self.seq = 0
+        return self.run
+
+    def finishRun(self):
+        if self.run is None:
+            return
+        self.conn.execute('UPDATE runs SET finished = ? WHERE run = ?', (time.time(), self.run))
+        self.conn.commit()
+
+    def record(self, resultSet):
+        ''' write MP_ResultSet resultSet to the current run (started if needed). '''
+        if self.run is None:
+            self.startRun()
+        cur = self.conn.execute('INSERT INTO resultsets (run, seq, name, time, predicted, error, journaled) '
+                                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (self.run, self.seq, str(resultSet.ID), resultSet.time,
+                                 getattr(resultSet, 'predicted', None), int(bool(resultSet.hasError)),
+                                 int(bool(getattr(resultSet, 'journaled', False)))))
+        intSet = cur.lastrowid
+        self.seq += 1
+        lstRows = []
+        for i, r in enumerate(resultSet.results):
+            lstRows.append((intSet, self.run, i, str(r.ID),
+                            json.dumps(r.args, default = repr),
+                            json.dumps(r.result, default = repr),
+                            r.time, r.error,
+                            json.dumps(getattr(r, 'usage', {}), default = repr),
+                            json.dumps(getattr(r, 'attempts', []), default = repr)))
+        self.conn.executemany('INSERT INTO results (resultset, run, seq, task, args, output, time, error, usage, attempts) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', lstRows)
+        self.conn.commit()
+
+    def runs(self, intLast = None):
+        ''' return a dictionary per run (newest first): run, started, finished,
+            workers, comment, tasksets and errors. '''
+        strSQL = 'SELECT r.run, r.started, r.finished, r.workers, r.comment, COUNT(s.id), ' \
+                 'COALESCE(SUM(s.error), 0) FROM runs r LEFT JOIN resultsets s ON s.run = r.run ' \
+                 'GROUP BY r.run ORDER BY r.run DESC'
+        if intLast:
+            strSQL += ' LIMIT ' + str(int(intLast))
+        lstKeys = ['run', 'started', 'finished', 'workers', 'comment', 'tasksets', 'errors']
+        return [dict(zip(lstKeys, row)) for row in self.conn.execute(strSQL)]
+
+    def lastRun(self):
+        return self.conn.execute('SELECT MAX(run) FROM runs').fetchone()[0]
+
+    def failed(self, intLast = 1):
+        ''' return the names of task sets with errors in any of the last intLast runs. '''
+        lstRuns = [d['run'] for d in self.runs(intLast)]
+        if not lstRuns:
+            return []
+        strSQL = 'SELECT DISTINCT name FROM resultsets WHERE error = 1 AND run IN (' + \
+                 ', '.join(['?'] * len(lstRuns)) + ') ORDER BY name'
+        return [row[0] for row in self.conn.execute(strSQL, lstRuns)]
+
+    def iterResults(self, intRun = None, bolErrors = False):
+        ''' yield (set name, set time, set error, task ID, output, time, error)
+            per stored result of run intRun in arrival order, read in a stream. '''
+        if intRun is None:
+            intRun = self.lastRun()
+        strSQL = 'SELECT s.name, s.time, s.error, r.task, r.output, r.time, r.error ' \
+                 'FROM results r JOIN resultsets s ON r.resultset = s.id WHERE r.run = ?'
+        if bolErrors:
+            strSQL += ' AND r.error IS NOT NULL'
+        strSQL += ' ORDER BY s.seq, r.seq'
+        for row in self.conn.execute(strSQL, (intRun,)):
+            yield row[:4] + (json.loads(row[4]),) + row[5:]
+
+    def printErrors(self, listAll = False, intRun = None):
+        ''' as PoolResults.printErrors, for run intRun. '''
+        intDefaultList = 6
+        if intRun is None:
+            intRun = self.lastRun()
+        intErrors = self.conn.execute('SELECT COUNT(*) FROM results WHERE run = ? AND error IS NOT NULL',
+                                      (intRun,)).fetchone()[0]
+        if listAll == True:
+            intDo = intErrors
+        else:
+            intDo = intDefaultList
+        i = 0
+        for strSet, fltSetTime, intSetError, strTask, output, fltTime, strError in self.iterResults(intRun, True):
+            print(strSet + ', ' + gen.time_string(fltSetTime) + ', EXCEPTION recorded.')
+            print('\t' + strTask + ', ' + gen.time_string(fltTime) + ', EXCEPTION: \n' + strError + '\n')
+            i += 1
+            if i == intDo:
+                intRemaining = intErrors - intDo
+                if intRemaining:
+                    print('Error descriptions limited to ' + str(intDo) + ' results.\n\t' + str(intRemaining) + ' reamining.')
+                break
+
+    def printResultsSets(self, intRun = None):
+        ''' as PoolResults.printResultsSets, for run intRun. '''
+        strLast = None
+        for strSet, fltSetTime, intSetError, strTask, output, fltTime, strError in self.iterResults(intRun):
+            if strSet != strLast:
+                print('\t' + strSet)
+                strLast = strSet
+            print('\t' + strTask + ': ' + str(output))
+
+    def listOutputs(self, intResultSetIndex = None, intRun = None):
+        ''' as PoolResults.listOutputs, for run intRun. Outputs that were not
+            JSON serializable come back as their repr. '''
+        if intRun is None:
+            intRun = self.lastRun()
+        if not intResultSetIndex is None:
+            strSQL = 'SELECT r.output FROM resultsets s JOIN results r ON r.resultset = s.id ' \
+                     'WHERE s.run = ? AND r.seq = ? ORDER BY s.seq'
+            return [json.loads(row[0]) for row in self.conn.execute(strSQL, (intRun, intResultSetIndex))]
+        lstOut = []
+        intLast = None
+        strSQL = 'SELECT r.resultset, r.output FROM results r JOIN resultsets s ON r.resultset = s.id ' \
+                 'WHERE r.run = ? ORDER BY s.seq, r.seq'
+        for intSet, strOutput in self.conn.execute(strSQL, (intRun,)):
+            if intSet != intLast:
+                lstOut.append([])
+                intLast = intSet
+            lstOut[-1].append(json.loads(strOutput))
+        return lstOut
+
+# ----------------------------------------
+# system load, from /proc (None where unavailable)
+def MemAvailableMB():
+    ''' return memory available for new work in MB from /proc/meminfo, or None. '''
+    try:
+        dicMem = {}
+        with open('/proc/meminfo') as f:
+            for strLine in f:
+                lstTok = strLine.split()
+                dicMem[lstTok[0].rstrip(':')] = int(lstTok[1])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    if 'MemAvailable' in dicMem:
+        return dicMem['MemAvailable'] / 1024.0
+    # older kernels
+    return (dicMem.get('MemFree', 0) + dicMem.get('Cached', 0) + dicMem.get('Buffers', 0)) / 1024.0
+
+def LoadAverage():
+    ''' return the 1 minute load average from /proc/loadavg, or None. '''
+    try:
+        with open('/proc/loadavg') as f:
+            return float(f.read().split()[0])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+# ----------------------------------------
+# pool classes
+class MP_Pool:
+    ''' persistent pool of worker processes. Successive batches of MP_TaskSets
+        run on the same (warm) workers, so process start up and module imports
+        are paid once. Use as a context manager, or call close() when done:
+            with MP_Pool(8) as mpPool:
+                prGround = mpPool.run(lstGroundTasks)
+                prDTM = mpPool.run(lstDTMTasks)
+            print(mpPool.stats)
+        Adaptive mode (bolAdaptive) treats intWorkers as a ceiling: a task set is
+        only dispatched while free memory (/proc/meminfo) stays above fltMinFreeMB
+        after its estimate (TaskSet.memory, else fltTaskMemMB) and the load
+        average (/proc/loadavg) is below fltMaxLoad per cpu. Dispatch is held
+        while headroom is low and ramps back up as it returns. One task set is
+        always allowed to run. Without /proc the checks are skipped.
+        Workers that die (OOM killer, crash in a native library) are detected
+        and replaced; the task set they held is requeued up to intCrashRetries
+        times, then recorded as an error instead of the pool waiting forever.
+        With intShareBytes, numpy array results of that size or more are
+        written by the worker to a scratch file in shareDir (default ShareDir)
+        and mapped read only by the parent instead of being pickled through
+        the pipe. The files are deleted by PoolResults.release (or when the
+        PoolResults is discarded), result sets from iterResults by
+        MP_ResultSet.release, and any left when the pool is closed or
+        terminated (mapped arrays stay readable on Linux). Files of pools
+        whose process died are deleted when a new sharing pool starts.
+    '''
+    def __init__(self, intWorkers, bolAdaptive = False, fltTaskMemMB = 0, fltMinFreeMB = 1024, fltMaxLoad = 1.0, intCrashRetries = 1, intShareBytes = None):
+        self.workers = intWorkers
+        self.shareBytes = intShareBytes
+        self.shareDir = None
+        self.sharePrefix = 'mp_share_' + str(os.getpid()) + '_' + str(id(self)) + '_'
+        if intShareBytes:
+            SweepShared(ShareDir())
+        self.crashRetries = intCrashRetries
+        self.adaptive = bolAdaptive
+        self.taskMemMB = fltTaskMemMB
+        self.minFreeMB = fltMinFreeMB
+        self.maxLoad = fltMaxLoad
+        self.settleSeconds = 60.0   # time for a new task's memory and load to show in /proc
+        self.pollSeconds = 1.0      # recheck interval for held dispatch and worker health
+        self.graceSeconds = 60.0    # allowed past a set's time limit before its worker is killed
+        self.lastCheck = time.time()
+        self.inflight = {}  # pool ID: (dispatch time, memory estimate)
+        self.maxInFlight = 0
+        self.backlog = collections.deque()  # (pool ID, TaskSet) waiting for a free worker
+        self.processes = []
+        self.conns = []     # parent end of each worker's pipe
+        self.busy = []      # pool ID held by each worker, or None
+        self.started = []   # time each worker was handed its set
+        self.limits = []    # time limit of each worker's set (MP_TaskSet.timeLimit)
+        self.killed = []    # worker killed for overrunning its limit
+        self.stats = []     # one dictionary per batch, see run
+        self.nextID = 0
+        for i in range(intWorkers):
+            self.processes.append(None)
+            self.conns.append(None)
+            self.busy.append(None)
+            self.started.append(None)
+            self.limits.append(None)
+            self.killed.append(False)
+            self.addWorker(i)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+        return False
+
+    def __str__(self):
+        strText = 'MP_Pool object\n\tWorkers: ' + str(self.workers) + \
+                  '\n\tBatches: ' + str(len(self.stats))
+        return strText
+
+    def addWorker(self, i):
+        ''' start (or replace) worker process i with a new pipe. '''
+        connParent, connChild = multiprocessing.Pipe()
+        p = multiprocessing.Process(target=poolworker, args=(connChild,))
+        p.start()
+        connChild.close()
+        self.processes[i] = p
+        self.conns[i] = connParent
+        self.busy[i] = None
+        self.started[i] = None
+        self.limits[i] = None
+        self.killed[i] = False
+        return p
+
+    def submit(self, TaskSet, bolFirst = False):
+        ''' queue one MP_TaskSet, returns its pool ID. bolFirst puts it ahead
+            of those already waiting for a worker. '''
+        if not self.processes:
+            raise Exception('MP_Pool is closed.')
+        ID = self.nextID
+        self.nextID += 1
+        if bolFirst:
+            self.backlog.appendleft((ID, TaskSet))
+        else:
+            self.backlog.append((ID, TaskSet))
+        self.feed()
+        return ID
+
+    def feed(self):
+        ''' hand waiting task sets to idle workers. '''
+        for i in range(len(self.processes)):
+            if not self.backlog:
+                break
+            if self.busy[i] is None and self.processes[i].is_alive():
+                ID, TS = self.backlog.popleft()
+                self.conns[i].send((ID, TS))
+                self.busy[i] = ID
+                self.started[i] = time.time()
+                self.limits[i] = TS.timeLimit() if hasattr(TS, 'timeLimit') else None
+
+    def receive(self, fltTimeout):
+        ''' return the next (ID, MP_ResultSet) from a worker, or None after
+            fltTimeout seconds or if a worker pipe broke (see checkWorkers). '''
+        fltEnd = time.time() + fltTimeout
+        while True:
+            for i, conn in enumerate(self.conns):
+                if self.busy[i] is None or not conn.poll():
+                    continue
+                try:
+                    msg = conn.recv()
+                except (EOFError, IOError):
+                    return None
+                self.busy[i] = None
+                self.started[i] = None
+                self.feed()
+                return msg
+            if time.time() >= fltEnd:
+                return None
+            time.sleep(0.005)
+
+    def killWorker(self, i):
+        ''' kill worker i and the commands it runs. '''
+        p = self.processes[i]
+        self.killed[i] = True
+        if os.name == 'nt':
+            KillTree(p.pid)
+        else:
+            # SIGTERM: the worker kills its command process groups and exits
+            p.terminate()
+        p.join(5)
+        if p.is_alive() and os.name != 'nt':
+            os.kill(p.pid, signal.SIGKILL)
+            p.join()
+
+    def checkWorkers(self, dicInFlight, dicCrashes):
+        ''' kill workers overrunning their set's time limit (plus graceSeconds)
+            and replace dead workers, requeueing the task sets they held (see
+            iterResults) or, past the retry limit or after a time limit kill,
+            returning (index, error result set) pairs for them. '''
+        lstFailed = []
+        fltNow = time.time()
+        for i, p in enumerate(self.processes):
+            if self.busy[i] is not None and self.limits[i] is not None and \
+               fltNow - self.started[i] > self.limits[i] + self.graceSeconds:
+                print('\t\t\tWorker process ' + str(p.pid) + ' over time limit, killed.')
+                self.killWorker(i)
+            if p.is_alive():
+                continue
+            ID = self.busy[i]
+            bolKilled = self.killed[i]
+            self.conns[i].close()
+            self.addWorker(i)
+            self.inflight.pop(ID, None)
+            if ID not in dicInFlight:
+                self.feed()
+                continue
+            item = dicInFlight.pop(ID)
+            intIndex, TS, TSRun, strKey = item
+            if bolKilled:
+                strError = 'Worker process ' + str(p.pid) + ' killed, task set over its time limit of ' + str(TS.timeLimit()) + ' s'
+                TS.resultSet = ErrorResultSet(TS, 'timeout', strError)
+                lstFailed.append((intIndex, TS.resultSet))
+                continue
+            strError = 'Worker process ' + str(p.pid) + ' died (exit code ' + str(p.exitcode) + ')'
+            dicCrashes[intIndex] = dicCrashes.get(intIndex, 0) + 1
+            if dicCrashes[intIndex] <= self.crashRetries:
+                print('\t\t\t' + strError + ', requeue: ' + str(TS.comment))
+                IDNew = self.submit(TSRun, True)
+                dicInFlight[IDNew] = item
+                self.inflight[IDNew] = (time.time(), self.memoryEstimate(TS))
+            else:
+                strError += ' on ' + str(dicCrashes[intIndex]) + ' attempt(s)'
+                TS.resultSet = ErrorResultSet(TS, 'worker', strError)
+                lstFailed.append((intIndex, TS.resultSet))
+        self.feed()
+        return lstFailed
+
+    def memoryEstimate(self, TaskSet):
+        ''' estimated memory in MB of TaskSet: TaskSet.memory or the pool default. '''
+        fltMem = getattr(TaskSet, 'memory', None)
+        if fltMem is None:
+            fltMem = self.taskMemMB
+        return fltMem
+
+    def canDispatch(self, TaskSet):
+        ''' adaptive mode: True if memory and load leave room for TaskSet now. '''
+        if not self.adaptive or not self.inflight:
+            return True
+        if len(self.inflight) >= self.workers:
+            return False
+        # dispatches too recent to show in /proc yet
+        fltNow = time.time()
+        lstRecent = [fltMem for t, fltMem in self.inflight.values() if fltNow - t < self.settleSeconds]
+        fltAvail = MemAvailableMB()
+        if fltAvail is not None:
+            if fltAvail - sum(lstRecent) - self.memoryEstimate(TaskSet) < self.minFreeMB:
+                return False
+        fltLoad = LoadAverage()
+        if fltLoad is not None:
+            if fltLoad + len(lstRecent) >= self.maxLoad * multiprocessing.cpu_count():
+                return False
+        return True
+
+    def iterResults(self, lstTasks, bolOrdered = False, intMaxInFlight = None, journal = None):
+        ''' generator yielding the MP_ResultSet of each MP_TaskSet of lstTasks
+            as soon as it completes, so downstream work can start before the
+            slowest task set finishes.
+                bolOrdered: yield in submission order instead, holding early
+                            finishers in a reorder buffer
+                intMaxInFlight: most task sets submitted but not yet returned
+                            (default 2 x workers). lstTasks is consumed lazily,
+                            so it may be a generator fed by an upstream stage:
+                    for rs in mpPool.iterResults(lstDTMTasks):
+                        ... convert finished tile ...
+            Task sets with dependencies (MP_TaskSet.dependencies) are held back
+            until those complete, so each tile's chain of stages proceeds as
+            soon as its own inputs are ready. Sets whose dependencies failed are
+            not run and yield an error result set. Results a set holds from an
+            earlier batch are cleared when it is pulled into this one (all of
+            lstTasks up front when it is a list), so a rerun dependency is
+            waited for again; a generator should yield dependencies before
+            the sets that need them.
+                journal: optional MP_Journal (or its path); completed sets are
+                         recorded and sets already in it are yielded from it
+        '''
+        if intMaxInFlight is None:
+            intMaxInFlight = 2 * self.workers
+        if isinstance(journal, basestring):
+            journal = MP_Journal(journal)
+        itTasks = iter(lstTasks)
+        # drop sets of an abandoned iteration still waiting for a worker
+        self.backlog.clear()
+        if isinstance(lstTasks, (list, tuple)):
+            # dependencies rerun in this batch must not look complete already
+            for TS in lstTasks:
+                TS.resultSet = None
+        lstWaiting = []     # (index, TaskSet) pulled but not submitted
+        dicInFlight = {}    # pool ID: (index, TaskSet, dispatched copy, journal key)
+        dicBuffer = {}      # index: result set (ordered mode)
+        dicCrashes = {}     # index: number of worker deaths
+        intSeen = 0
+        intNext = 0
+        bolMore = True
+        while True:
+            lstDone = []
+            # pull new task sets while there is room
+            while bolMore and len(dicInFlight) + len(lstWaiting) < intMaxInFlight:
+                try:
+                    TS = next(itTasks)
+                except StopIteration:
+                    bolMore = False
+                    break
+                TS.resultSet = None
+                lstWaiting.append((intSeen, TS))
+                intSeen += 1
+
+            # release ready (or failed) task sets in order
+            for item in list(lstWaiting):
+                intIndex, TS = item
+                strState = TS.dependencyState()
+                if strState == 'failed':
+                    TS.resultSet = SkippedResultSet(TS)
+                    lstDone.append((intIndex, TS.resultSet))
+                    lstWaiting.remove(item)
+                elif strState == 'ready' and len(dicInFlight) < intMaxInFlight:
+                    TSRun = TS.resolved()
+                    strKey = None
+                    if journal:
+                        strKey = journal.key(TSRun)
+                        dicRec = journal.lookup(TSRun, strKey)
+                        if dicRec:
+                            TS.resultSet = journal.resultSet(dicRec)
+                            lstDone.append((intIndex, TS.resultSet))
+                            lstWaiting.remove(item)
+                            continue
+                    if not self.canDispatch(TS):
+                        continue
+                    if self.shareBytes:
+                        TSRun.share = (self.shareBytes, self.shareDir or ShareDir(), self.sharePrefix)
+                    ID = self.submit(TSRun)
+                    dicInFlight[ID] = (intIndex, TS, TSRun, strKey)
+                    self.inflight[ID] = (time.time(), self.memoryEstimate(TS))
+                    self.maxInFlight = max(self.maxInFlight, len(self.inflight))
+                    lstWaiting.remove(item)
+
+            if not lstDone and not dicInFlight:
+                # nothing running: finished, or every pulled set waits on sets
+                # not pulled yet
+                if bolMore:
+                    try:
+                        TS = next(itTasks)
+                        TS.resultSet = None
+                        lstWaiting.append((intSeen, TS))
+                        intSeen += 1
+                        continue
+                    except StopIteration:
+                        bolMore = False
+                if lstWaiting:
+                    raise Exception('MP_TaskSet dependencies never run for: ' + ', '.join([str(TS.comment) for i, TS in lstWaiting]))
+                break
+
+            if not lstDone:
+                # wake up every pollSeconds to check workers and held dispatches
+                msg = self.receive(self.pollSeconds)
+                if msg is None or time.time() - self.lastCheck > self.pollSeconds:
+                    lstDone = self.checkWorkers(dicInFlight, dicCrashes)
+                    self.lastCheck = time.time()
+                if msg is not None:
+                    ID, resultSet = msg
+                    self.inflight.pop(ID, None)
+                    resultSet.mapShared()
+                    if ID in dicInFlight:
+                        intIndex, TS, TSRun, strKey = dicInFlight.pop(ID)
+                        TS.resultSet = resultSet
+                        if journal:
+                            journal.record(TSRun, resultSet, strKey)
+                        lstDone.append((intIndex, resultSet))
+                    else:
+                        # left over from an abandoned iteration
+                        resultSet.release()
+
+            for intIndex, resultSet in lstDone:
+                if not bolOrdered:
+                    yield resultSet
+                    continue
+                dicBuffer[intIndex] = resultSet
+                while intNext in dicBuffer:
+                    yield dicBuffer.pop(intNext)
+                    intNext += 1
+
+    def run(self, lstTasks, txtPickle = None, bolOrdered = False, costModel = None, journal = None, store = None):
+        ''' run a batch of MP_TaskSets, returning a PoolResults.
+            A stats snapshot of the batch is appended to self.stats.
+                costModel: optional MP_CostModel; task sets are dispatched
+                           longest predicted first and predictions recorded
+                           (PoolResults.printPredicted). The batch's times are
+                           added to the model afterwards.
+                journal: optional MP_Journal (or path) to resume from and record to
+                store: optional MP_ResultStore (or path), each result set is
+                       written to a new run as it arrives
+        '''
+        bolOwnStore = isinstance(store, basestring)
+        if bolOwnStore:
+            store = MP_ResultStore(store)
+        print('\n\tStart Pool:')
+        print('\t\t' + str(len(lstTasks)) + ' task(s).')
+        print('\t\t' + str(self.workers) + ' worker(s).')
+        t0 = time.time()
+        iPoolResult = PoolResults(self.workers)
+        self.maxInFlight = 0
+        if costModel:
+            lstTasks = costModel.order(lstTasks)
+            iPoolResult.predictedRuntime = costModel.makespan(lstTasks, self.workers)
+            print('\t\tPredicted: ' + gen.time_string(iPoolResult.predictedRuntime))
+
+        # Get and print results
+        if bolOrdered:
+            print('\t\tOrdered results:')
+        else:
+            print('\t\tUnordered results:')
+        if store:
+            store.startRun(self.workers)
+        for resultSet in self.iterResults(lstTasks, bolOrdered, len(lstTasks), journal):
+            print('\t\t\t' + str(resultSet))
+            iPoolResult.record(resultSet)
+            if store:
+                store.record(resultSet)
+        if store:
+            store.finishRun()
+            if bolOwnStore:
+                store.close()
+
+        iPoolResult.runtime = time.time() - t0
+        self.stats.append(self.batchStats(iPoolResult))
+        if costModel:
+            costModel.load(iPoolResult)
+
+        if iPoolResult.ErrorCount:
+            print('\n\t\tPool done: WITH ERRORS!.\n')
+        else:
+            print('\n\t\tPool done: ' + gen.time_string(iPoolResult.runtime) + '\n')
+
+        if txtPickle:
+            iPoolResult.Pickle(txtPickle)
+
+        return iPoolResult
+
+    def batchStats(self, iPoolResult):
+        ''' return a dictionary of batch statistics for PoolResults iPoolResult.
+            utilization: summed task set time / (runtime * workers)
+        '''
+        fltBusy = sum([rs.time for rs in iPoolResult.ResultSets if not rs.journaled])
+        fltCapacity = iPoolResult.runtime * self.workers
+        return {'batch': len(self.stats),
+                'workers': self.workers,
+                'tasksets': iPoolResult.Count,
+                'errors': iPoolResult.ErrorCount,
+                'runtime': iPoolResult.runtime,
+                'tasktime': fltBusy,
+                'maxinflight': self.maxInFlight,
+                'utilization': fltBusy / fltCapacity if fltCapacity else 0.0}
+
+    def close(self):
+        ''' stop workers once they finish their current set and wait for them. '''
+        self.backlog.clear()
+        for i, p in enumerate(self.processes):
+            try:
+                self.conns[i].send('STOP')
+            except (IOError, OSError):
+                pass
+        for i, p in enumerate(self.processes):
+            p.join()
+            self.conns[i].close()
+        self.processes = []
+        self.releaseShared()
+
+    def terminate(self):
+        ''' stop workers immediately, abandoning their work. '''
+        self.backlog.clear()
+        for i, p in enumerate(self.processes):
+            p.terminate()
+            p.join()
+            self.conns[i].close()
+        self.processes = []
+        self.releaseShared()
+
+    def releaseShared(self):
+        ''' delete shared array scratch files of this pool still on disk. '''
+        if self.shareBytes:
+            SweepShared(self.shareDir or ShareDir(), self.sharePrefix)
+
+# ----------------------------------------
+# command executor
+# command string tasks (pool2.submit of FUSION / LAStools commands) need no
+# python worker process each: MP_CommandPool runs them as subprocesses from
+# threads of the calling process, a thread per concurrent command, and
+# reports MP_Results in PoolResults like DoPool.
+class MP_Command:
+    ''' a command string to run by MP_CommandPool.
+        optional output is checked as by submit: an existing output skips the
+        command, a missing output after it runs is an error.
+    '''
+    def __init__(self, cmd, output = None, comment = None):
+        self.cmd = cmd
+        self.output = output
+        self.comment = comment if comment is not None else cmd
+
+    def __str__(self):
+        return 'MP_Command: ' + self.cmd
+
+def RunCommand(command):
+    ''' run MP_Command command, returning an MP_Result with stdout, stderr and
+        returncode attributes. '''
+    iResult = MP_Result(command.comment, [command.cmd, command.output])
+    iResult.stdout = iResult.stderr = ''
+    iResult.returncode = None
+    t0 = time.time()
+    try:
+        if command.output and os.path.exists(command.output):
+            iResult.result = command.output
+            return iResult
+        proc = subprocess.Popen(command.cmd, shell = True, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        iResult.stdout, iResult.stderr = proc.communicate()
+        iResult.returncode = proc.returncode
+        if command.output:
+            if not os.path.exists(command.output):
+                raise Exception('Output not created: ' + command.output + '\nmessage:\n' + iResult.stderr)
+            iResult.result = command.output
+        else:
+            if proc.returncode:
+                raise Exception('Nonzero exit status ' + str(proc.returncode) + '.\nmessage:\n' + iResult.stderr)
+            iResult.result = 'submit'
+    except Exception:
+        iResult.error = traceback.format_exc()
+    finally:
+        iResult.time = time.time() - t0
+    return iResult
+
+def commandworker(qInput, qOutput):
+    ''' MP_CommandPool thread function: runs (ID, MP_Command) messages until 'STOP'. '''
+    for ID, command in iter(qInput.get, 'STOP'):
+        qOutput.put((ID, RunCommand(command)))
+
+class MP_CommandPool:
+    ''' runs command strings as subprocesses, at most intConcurrency at once,
+        from threads of this process instead of a python worker process each.
+        Commands are MP_Command instances or plain command strings.
+            pr = MP_CommandPool(16).run([MP_Command(cmd, strPathOut) for cmd, strPathOut in lstCmds])
+    '''
+    def __init__(self, intConcurrency):
+        self.workers = intConcurrency
+
+    def iterResults(self, lstCommands):
+        ''' generator yielding an MP_Result per command as it completes. '''
+        qInput = Queue.Queue()
+        qOutput = Queue.Queue()
+        lstThreads = []
+        for i in range(self.workers):
+            th = threading.Thread(target = commandworker, args = (qInput, qOutput))
+            th.daemon = True
+            th.start()
+            lstThreads.append(th)
+        try:
+            intCount = 0
+            for command in lstCommands:
+                if isinstance(command, basestring):
+                    command = MP_Command(command)
+                qInput.put((intCount, command))
+                intCount += 1
+            for i in range(intCount):
+                ID, iResult = qOutput.get()
+                yield iResult
+        finally:
+            # if iteration stopped early, drop commands not yet started so
+            # the threads stop after the ones running now
+            while True:
+                try:
+                    qInput.get_nowait()
+                except Queue.Empty:
+                    break
+            for th in lstThreads:
+                qInput.put('STOP')
+        # threads are idle once every result is in
+        for th in lstThreads:
+            th.join()
+
+    def run(self, lstCommands, txtPickle = None):
+        ''' run lstCommands, returning a PoolResults of one MP_ResultSet per command. '''
+        print('\n\tStart Command Pool:')
+        print('\t\t' + str(len(lstCommands)) + ' command(s).')
+        print('\t\t' + str(self.workers) + ' concurrent.')
+        t0 = time.time()
+        iPoolResult = PoolResults(self.workers)
+        print('\t\tUnordered results:')
+        for iResult in self.iterResults(lstCommands):
+            iResultSet = MP_ResultSet(iResult.ID)
+            iResultSet.addResult(iResult)
+            iResultSet.time = iResult.time
+            iResultSet.hasError = iResult.error is not None
+            print('\t\t\t' + str(iResultSet))
+            iPoolResult.record(iResultSet)
+        iPoolResult.runtime = time.time() - t0
+
+        if iPoolResult.ErrorCount:
+            print('\n\t\tCommand pool done: WITH ERRORS!.\n')
+        else:
+            print('\n\t\tCommand pool done: ' + gen.time_string(iPoolResult.runtime) + '\n')
+        if txtPickle:
+            iPoolResult.Pickle(txtPickle)
+        return iPoolResult
+
+def DoPool(lstTasks, intWorkers, txtPickle = None, costModel = None, journal = None, bolAdaptive = False, fltTaskMemMB = 0, intShareBytes = None, store = None):
+    ''' run MP_TaskSets lstTasks on a new MP_Pool of intWorkers, returning
+        a PoolResults. Use an MP_Pool directly to reuse workers across batches.
+        costModel: optional MP_CostModel for longest first dispatch.
+        journal: optional MP_Journal (or path) to resume from and record to.
+        bolAdaptive, fltTaskMemMB: memory and load aware dispatch, see MP_Pool.
+        intShareBytes: return arrays of this size or more through scratch files, see MP_Pool.
+        store: optional MP_ResultStore (or path) recording results as they arrive.
+    '''
+    with MP_Pool(intWorkers, bolAdaptive, fltTaskMemMB, intShareBytes = intShareBytes) as mpPool:
+        return mpPool.run(lstTasks, txtPickle, costModel = costModel, journal = journal, store = store)
+
+def IterPool(lstTasks, intWorkers, bolOrdered = False, intMaxInFlight = None):
+    ''' generator yielding MP_ResultSets of lstTasks as they complete, from a
+        new MP_Pool of intWorkers closed when iteration ends.
+        See MP_Pool.iterResults for arguments.
+    '''
+    with MP_Pool(intWorkers) as mpPool:
+        for resultSet in mpPool.iterResults(lstTasks, bolOrdered, intMaxInFlight):
+            yield resultSet
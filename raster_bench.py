@@ -0,0 +1,130 @@
+# -------------------------------------------------------
+# raster_bench.py
+#
+# Timing comparisons for raster.py ascii grid routines.
+# Each benchmark times the current raster.py implementation against the
+# original pure python loop it replaced.
+#
+# usage:
+#   import raster_bench as rb
+#   rb.BenchmarkIngest(rb.MakeTestGrid(r'C:\temp\bench.asc', 2000, 2000))
+# -------------------------------------------------------
+import os, time
+import numpy
+import raster
+
+def MakeTestGrid(strPathOut, intRows, intCols, fltNODATA = -9999.0):
+    """ Write a random ascii grid of intRows x intCols for benchmarking.
+        Roughly 1 percent of cells are NODATA. Returns strPathOut.
+    """
+    arr = numpy.random.uniform(0, 60, (intRows, intCols)).round(2)
+    arr[numpy.random.uniform(size = arr.shape) < 0.01] = fltNODATA
+    with open(strPathOut, 'w') as outfile:
+        outfile.write('ncols         ' + str(intCols) + '\n')
+        outfile.write('nrows         ' + str(intRows) + '\n')
+        outfile.write('xllcorner     500000\n')
+        outfile.write('yllcorner     4000000\n')
+        outfile.write('cellsize      1\n')
+        outfile.write('NODATA_value  ' + str(fltNODATA) + '\n')
+        for row in arr:
+            outfile.write(' '.join([str(v) for v in row]) + '\n')
+    return strPathOut
+
+def RowLoopIngest(strPathRast):
+    """ Original rasterobject ingest: one readline/split/assign per row. """
+    with open(strPathRast) as inImage:
+        lstheader = [inImage.readline().strip() for i in range(6)]
+        intcols = int(lstheader[0].split()[1])
+        introws = int(lstheader[1].split()[1])
+        data = numpy.zeros((introws, intcols), dtype=float, order='C')
+        for i in range(introws):
+            data[i] = inImage.readline().strip().split()
+    return data
+
+def TimeCall(func, args, intRepeats):
+    """ Return (best time in seconds, last result) of intRepeats calls of func(*args). """
+    fltBest = None
+    for i in range(intRepeats):
+        t0 = time.time()
+        r = func(*args)
+        t = time.time() - t0
+        if fltBest is None or t < fltBest:
+            fltBest = t
+    return fltBest, r
+
+def BenchmarkIngest(strPathRast, intRepeats = 3):
+    """ Time raster.rasterobject ingest against the original row loop.
+        Prints and returns a dictionary of best times in seconds.
+    """
+    intMB = os.path.getsize(strPathRast) / 2.0 ** 20
+    tLoop, arrLoop = TimeCall(RowLoopIngest, [strPathRast], intRepeats)
+    tBulk, rast = TimeCall(raster.rasterobject, [strPathRast], intRepeats)
+    if not numpy.array_equal(arrLoop, rast.data):
+        raise Exception('bulk ingest does not match row loop ingest')
+
+    dicTimes = {'rowloop': tLoop, 'bulk': tBulk}
+    print('Ingest ' + strPathRast + ' (' + str(round(intMB, 1)) + ' MB, ' + str(rast.data.size) + ' cells)')
+    print('\trow loop: ' + str(round(tLoop, 3)) + ' s')
+    print('\tbulk:     ' + str(round(tBulk, 3)) + ' s (' + str(round(tLoop / tBulk, 1)) + 'x)')
+    return dicTimes
+
+def LoopApplyKernel(data, arrKern, fltNODATA):
+    """ Original rasterobject.ApplyKernel cell loop (column range corrected). """
+    r, c = arrKern.shape
+    gr, gc = r // 2, c // 2
+    introws, intcols = data.shape
+    arrout = data.copy()
+    for j in range(gr, introws - gr):
+        for i in range(gc, intcols - gc):
+            if data[j,i] == fltNODATA:
+                continue
+            arrout[j,i] = (data[j-gr:j+gr+1, i-gc:i+gc+1] * arrKern).sum()
+    return arrout
+
+def BenchmarkKernel(intSize = 500, intKern = 5, intRepeats = 3):
+    """ Time raster.Convolve against the original cell loop on a random
+        intSize x intSize grid with a intKern x intKern kernel (general and
+        constant weights). Prints and returns a dictionary of best times in seconds.
+    """
+    data = numpy.random.uniform(0, 60, (intSize, intSize))
+    dicTimes = {}
+    print('ApplyKernel ' + str(intSize) + ' x ' + str(intSize) + ', kernel ' + str(intKern) + ' x ' + str(intKern))
+    for strName, arrKern in [('general', numpy.random.uniform(size = (intKern, intKern))),
+                             ('constant', numpy.ones((intKern, intKern)))]:
+        tLoop, r = TimeCall(LoopApplyKernel, [data, arrKern, -9999.0], 1)
+        tVec, r = TimeCall(raster.Convolve, [data, arrKern, -9999.0], intRepeats)
+        dicTimes[strName] = {'loop': tLoop, 'vectorized': tVec}
+        print('\t' + strName + ' loop:       ' + str(round(tLoop, 3)) + ' s')
+        print('\t' + strName + ' vectorized: ' + str(round(tVec, 3)) + ' s (' + str(round(tLoop / tVec, 1)) + 'x)')
+    return dicTimes
+
+def LoopSaveAs(rast, strPathoutfile):
+    """ Original rasterobject.SaveSelfAs: str() per cell, joined per row. """
+    outfile = open(strPathoutfile, "w")
+    outfile.write(rast.AssembleHeader())
+    for i in range(rast.data.shape[0]):
+        lstline = []
+        for j in rast.data[i]:
+            lstline.append(str(j))
+        outfile.write(" ".join(lstline) + "\n")
+    outfile.close()
+    return strPathoutfile
+
+def BenchmarkWrite(rast, strDir, intRepeats = 3):
+    """ Time rasterobject.SaveSelfAs (full precision, 2 decimal, gzip) against the
+        original per cell loop, writing into strDir.
+        Prints and returns a dictionary of (seconds, MB/s) per method.
+    """
+    dicRuns = [('loop',       LoopSaveAs,       [rast, os.path.join(strDir, 'bench_loop.asc')]),
+               ('full',       rast.SaveSelfAs,  [os.path.join(strDir, 'bench_full.asc')]),
+               ('2 decimal',  rast.SaveSelfAs,  [os.path.join(strDir, 'bench_2dec.asc'), 2, '-9999']),
+               ('gzip',       rast.SaveSelfAs,  [os.path.join(strDir, 'bench_gzip.asc.gz'), 2, '-9999'])]
+    dicTimes = {}
+    print('Write ' + str(rast.data.size) + ' cells')
+    for strName, func, args in dicRuns:
+        t, strPathOut = TimeCall(func, args, intRepeats)
+        fltMB = os.path.getsize(strPathOut) / 2.0 ** 20
+        dicTimes[strName] = (t, fltMB / t)
+        print('\t' + strName.ljust(10) + ' ' + str(round(t, 3)) + ' s, ' + str(round(fltMB / t, 1)) + ' MB/s written')
+        os.remove(strPathOut)
+    return dicTimes
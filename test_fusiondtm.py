@@ -0,0 +1,81 @@
+''' checks for fusiondtm, run with python -m unittest test_fusiondtm '''
+import os, struct, tempfile, shutil, unittest
+import numpy
+import fusiondtm
+
+def PackAt(arrHeader, intOffset, strFormat, *args):
+    ''' pack args into bytearray arrHeader at intOffset. '''
+    strPacked = struct.pack('<' + strFormat, *args)
+    arrHeader[intOffset:intOffset + len(strPacked)] = strPacked
+
+def FusionDTM(strPath, fltVersion, intZType, arrCols, lstCodes):
+    ''' write a .dtm field by field at the byte offsets of the PLANS DTM
+        table in the FUSION manual, independently of strHeaderFormat.
+            arrCols: elevations as (columns, points), each column south to north
+            lstCodes: xy units, z units, coordsys, zone, hdatum, vdatum '''
+    arrHeader = bytearray(200)
+    intCols, intPoints = arrCols.shape
+    PackAt(arrHeader, 0, '21s', 'PLANS-PC BINARY .DTM')
+    PackAt(arrHeader, 21, '61s', 'fusion test')
+    PackAt(arrHeader, 82, 'f', fltVersion)
+    PackAt(arrHeader, 86, 'dddd', 1000.0, 2000.0, 1000.0 + 2 * (intCols - 1), 2000.0 + 2 * (intPoints - 1))
+    PackAt(arrHeader, 118, 'ii', intCols, intPoints)
+    PackAt(arrHeader, 126, 'dd', 2.0, 2.0)
+    arrValid = arrCols[arrCols != -1]
+    PackAt(arrHeader, 142, 'dd', float(arrValid.min()), float(arrValid.max()))
+    PackAt(arrHeader, 158, 'hh', lstCodes[0], lstCodes[1])
+    if fltVersion >= 2.0:
+        PackAt(arrHeader, 162, 'h', intZType)
+    if fltVersion >= 3.0:
+        PackAt(arrHeader, 164, 'hhhh', *lstCodes[2:])
+    with open(strPath, 'wb') as f:
+        f.write(arrHeader)
+        f.write(arrCols.astype(numpy.dtype(fusiondtm.dicZTypes[intZType]).newbyteorder('<')).tostring())
+    return strPath
+
+class PlansHeaderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # 3 columns of 2 points, -1 is no data
+        self.cols = numpy.array([[1.5, 2.5], [-1.0, 4.5], [5.5, 6.5]])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_version3_header(self):
+        strPath = FusionDTM(os.path.join(self.dir, 'v3.dtm'), 3.1, 2, self.cols, [1, 1, 1, 10, 2, 2])
+        dicHeader = fusiondtm.ReadDTMHeader(strPath)
+        self.assertEqual([dicHeader[k] for k in ['xyunits', 'zunits', 'ztype', 'coordsys', 'zone', 'hdatum', 'vdatum']],
+                         [1, 1, 2, 1, 10, 2, 2])
+        self.assertEqual((dicHeader['columns'], dicHeader['points']), (3, 2))
+        rast = fusiondtm.ReadDTM(strPath, False)
+        self.assertEqual((rast.fltxll, rast.fltyll), (999.0, 1999.0))
+        # north up rows
+        self.assertTrue(numpy.array_equal(rast.data, [[2.5, 4.5, 6.5], [1.5, -1.0, 5.5]]))
+
+    def test_version2_header(self):
+        strPath = FusionDTM(os.path.join(self.dir, 'v2.dtm'), 2.0, 3, self.cols, [0, 0, 1, 10, 2, 2])
+        dicHeader = fusiondtm.ReadDTMHeader(strPath)
+        self.assertEqual(dicHeader['ztype'], 3)
+        self.assertEqual([dicHeader[k] for k in ['coordsys', 'zone', 'hdatum', 'vdatum']], [0, 0, 0, 0])
+        self.assertEqual(fusiondtm.ReadDTM(strPath).data.dtype, numpy.float64)
+
+    def test_version1_header(self):
+        strPath = FusionDTM(os.path.join(self.dir, 'v1.dtm'), 1.0, 0, numpy.array([[1, 2], [3, 4]]), [0, 0, 1, 10, 2, 2])
+        dicHeader = fusiondtm.ReadDTMHeader(strPath)
+        self.assertEqual(dicHeader['ztype'], 0)
+        self.assertTrue(numpy.array_equal(fusiondtm.ReadDTM(strPath).data, [[2, 4], [1, 3]]))
+
+    def test_write_matches_layout(self):
+        strPath = FusionDTM(os.path.join(self.dir, 'v3.dtm'), 3.1, 2, self.cols, [1, 1, 1, 10, 2, 2])
+        rast = fusiondtm.ReadDTM(strPath, False)
+        strOut = fusiondtm.WriteDTM(rast, os.path.join(self.dir, 'out.dtm'))
+        with open(strPath, 'rb') as f:
+            strExpected = f.read()
+        with open(strOut, 'rb') as f:
+            strWritten = f.read()
+        # name field aside (WriteDTM writes dtminfo name) the files match byte for byte
+        self.assertEqual(strWritten[:21] + strWritten[82:], strExpected[:21] + strExpected[82:])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+''' checks for pool2, run with python -m unittest test_pool2 '''
+import os, tempfile, shutil, unittest
+import pool2
+
+def Upstream(strPath):
+    ''' write strPath + '.up', return the (tuple) of written paths. '''
+    with open(strPath + '.up', 'w') as f:
+        f.write('up')
+    return (strPath + '.up',)
+
+def Downstream(tupPaths):
+    ''' count runs in a side file next to the upstream output. '''
+    strPath = tupPaths[0] + '.down'
+    with open(strPath, 'a') as f:
+        f.write('x')
+    return strPath
+
+class JournalResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def tasks(self):
+        tsUp = pool2.MP_TaskSet('up')
+        tsUp.addTask(pool2.MP_Task(Upstream, [os.path.join(self.dir, 'a')]))
+        tsDown = pool2.MP_TaskSet('down')
+        tsDown.addTask(pool2.MP_Task(Downstream, [pool2.MP_Ref(tsUp)]))
+        return [tsUp, tsDown]
+
+    def test_ref_chain_resumes(self):
+        ''' a rerun of an MP_Ref chain takes both sets from the journal. '''
+        strJournal = os.path.join(self.dir, 'run.journal')
+        pr = pool2.DoPool(self.tasks(), 2, journal = strJournal)
+        self.assertEqual(pr.ErrorCount, 0)
+        with open(strJournal) as f:
+            intLines = len(f.readlines())
+        self.assertEqual(intLines, 2)
+
+        pr = pool2.DoPool(self.tasks(), 2, journal = strJournal)
+        self.assertEqual(pr.ErrorCount, 0)
+        self.assertTrue(all([rs.journaled for rs in pr.ResultSets]))
+        with open(strJournal) as f:
+            self.assertEqual(len(f.readlines()), intLines)
+        with open(os.path.join(self.dir, 'a.up.down')) as f:
+            self.assertEqual(f.read(), 'x')
+        self.assertEqual(pr.ResultSets[-1].results[0].result, os.path.join(self.dir, 'a.up.down'))
+        self.assertTrue(isinstance(pr.ResultSets[-1].results[0].result, str))
+
+if __name__ == '__main__':
+    unittest.main()